@@ -1,16 +1,23 @@
+import argparse
+import collections
+import html
 import requests
-import simplekml
-import zipfile
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import kmlstream
 
 
 output_dir = "output"
 os.makedirs(output_dir, exist_ok=True)
 
-geojson_projects = os.path.join(output_dir, "projects_data.geojson")
-geojson_lines = os.path.join(output_dir, "transmission_lines_data.geojson")
-kml_file = os.path.join(output_dir, "canada_grid.kml")
+# GeoJSON por linhas (uma Feature por linha, sem indentação)
+geojson_projects = os.path.join(output_dir, "projects_data.geojsonl")
+geojson_lines = os.path.join(output_dir, "transmission_lines_data.geojsonl")
+kml_name = "canada_grid.kml"   # nome do KML dentro do KMZ
 kmz_file = os.path.join(output_dir, "canada_grid.kmz")
 
 
@@ -22,47 +29,165 @@ urls = {
 
 params = {"where": "1=1", "outFields": "*", "f": "geojson"}
 
-def download_data(url, filepath):
-    response = requests.get(url, params=params)
-    if response.status_code == 200:
-        with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(response.json(), f, indent=4)
-        print(f"✅ Data saved: {filepath}")
-    else:
-        print(f"❌ Error fetching data: {response.status_code}")
-
+WORKERS = 4          # páginas pedidas em paralelo
+INFLIGHT_PER_WORKER = 2  # páginas pedidas/à espera por worker (memória limitada)
+TIMEOUT = 120
+DEFAULT_PAGE = 1000  # se o serviço não disser o maxRecordCount
+
+KML_HEAD = [
+    '<?xml version="1.0" encoding="UTF-8"?>',
+    '<kml xmlns="http://www.opengis.net/kml/2.2">',
+    "<Document>",
+    "<name>canada_grid</name>",
+]
+KML_TAIL = "</Document></kml>"
+PLACEMARK = "<Placemark><name>{name}</name><description>{desc}</description>{geom}</Placemark>"
+
+
+def make_session(workers=WORKERS, retries=5):
+    """Session com pool de ligações do tamanho do nº de workers e retry com backoff (429/5xx)."""
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(["GET"]))
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=workers, pool_maxsize=workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _get_json(session, url, query):
+    r = session.get(url, params=query, timeout=TIMEOUT)
+    r.raise_for_status()
+    data = r.json()
+    if isinstance(data, dict) and "error" in data:  # o ArcGIS devolve erros com HTTP 200
+        raise RuntimeError(f"ArcGIS error: {data['error']}")
+    return data
+
+
+def layer_info(session, url):
+    """Metadados da camada (o URL da camada é o de /query sem o sufixo)."""
+    return _get_json(session, url.rsplit("/query", 1)[0], {"f": "json"})
+
+
+def plan_pages(session, url, page_size=None):
+    """
+    Lista de queries, uma por página. Usa resultOffset/resultRecordCount se o
+    serviço suportar paginação; caso contrário, intervalos de OBJECTID.
+    """
+    info = layer_info(session, url)
+    size = page_size or info.get("maxRecordCount") or DEFAULT_PAGE
+    oid = info.get("objectIdField") or "OBJECTID"
+
+    if info.get("advancedQueryCapabilities", {}).get("supportsPagination"):
+        total = _get_json(session, url, {"where": params["where"], "returnCountOnly": "true", "f": "json"})["count"]
+        pages = [dict(params, resultOffset=off, resultRecordCount=size, orderByFields=oid)
+                 for off in range(0, total, size)]
+        return total, pages
+
+    res = _get_json(session, url, {"where": params["where"], "returnIdsOnly": "true", "f": "json"})
+    oid = res.get("objectIdFieldName") or oid
+    ids = sorted(res.get("objectIds") or [])
+    pages = [dict(params, where=f"{oid} >= {chunk[0]} AND {oid} <= {chunk[-1]}")
+             for chunk in (ids[i:i + size] for i in range(0, len(ids), size))]
+    return len(ids), pages
+
+
+def download_data(url, filepath, session=None, workers=WORKERS, page_size=None, on_feature=None):
+    """
+    Descarrega todas as features da camada (sem o corte do maxRecordCount) com
+    páginas em paralelo e grava-as à medida, pela ordem das páginas, em GeoJSON
+    por linhas. Só há INFLIGHT_PER_WORKER × workers páginas pedidas ou à espera
+    de vez de cada vez, por isso a memória não cresce com a camada. Cada feature
+    é lida uma só vez e passada também a `on_feature` (ex.: escrita do placemark
+    no KMZ). Num erro, as páginas ainda por pedir são canceladas e o .part é
+    apagado. Devolve o nº de features gravadas.
+    """
+    session = session or make_session(workers)
+    total, pages = plan_pages(session, url, page_size)
+    written = 0
+    tmp = filepath + ".part"
+    todo = iter(pages)
+    window = collections.deque()
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for q in todo:
+            window.append(pool.submit(_get_json, session, url, q))
+            if len(window) >= INFLIGHT_PER_WORKER * workers:
+                break
+        with open(tmp, "w", encoding="utf-8") as f:
+            while window:
+                data = window.popleft().result()
+                nxt = next(todo, None)
+                if nxt is not None:
+                    window.append(pool.submit(_get_json, session, url, nxt))
+                for feature in data.get("features", []):
+                    f.write(json.dumps(feature, ensure_ascii=False, separators=(",", ":")))
+                    f.write("\n")
+                    written += 1
+                    if on_feature:
+                        on_feature(feature)
+        os.replace(tmp, filepath)
+    finally:
+        # num erro não espera pelas páginas em curso (no máximo `workers`)
+        pool.shutdown(wait=False, cancel_futures=True)
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+    if written != total:
+        print(f"⚠️ {os.path.basename(filepath)}: {written} features gravadas de {total} anunciadas pelo serviço")
+    print(f"✅ Data saved: {filepath} ({written} features, {len(pages)} páginas)")
+    return written
+
+
+def detect_voltage_field(props):
+    for key in props or {}:
+        if "voltage" in key.lower():
+            return key
+    return None
 
-download_data(urls["projects"], geojson_projects)
-download_data(urls["transmission_lines"], geojson_lines)
 
+def _coords(seq):
+    # mantém o Z quando a coordenada o traz (como fazia o simplekml); senão 0
+    return " ".join(f"{c[0]},{c[1]},{c[2] if len(c) > 2 else 0}" for c in seq)
+
+def geometry_kml(geometry):
+    geom_type = geometry["type"]
+    coords = geometry["coordinates"]
+    if geom_type == "Point":
+        return f"<Point><coordinates>{_coords([coords])}</coordinates></Point>"
+    if geom_type == "LineString":
+        return f"<LineString><coordinates>{_coords(coords)}</coordinates></LineString>"
+    if geom_type == "Polygon":
+        return (f"<Polygon><outerBoundaryIs><LinearRing><coordinates>{_coords(coords[0])}"
+                "</coordinates></LinearRing></outerBoundaryIs></Polygon>")
+    return None
 
-kml = simplekml.Kml()
 
-def detect_voltage_field(geojson_file):
-    with open(geojson_file, "r", encoding="utf-8") as f:
-        geojson_data = json.load(f)
-    if "features" in geojson_data and geojson_data["features"]:
-        props = geojson_data["features"][0]["properties"]
-        for key in props:
-            if "voltage" in key.lower():
-                return key
-    return None
+class PlacemarkWriter:
+    """
+    Escreve cada feature como placemark diretamente no KMZ. O campo de tensão
+    das linhas é detetado na primeira feature da camada, à medida que chega.
+    """
 
-voltage_field = detect_voltage_field(geojson_lines)
+    def __init__(self, kz, layer_type):
+        self.kz = kz
+        self.layer_type = layer_type
+        self.voltage_field = None
+        self._first = True
 
-def add_features_to_kml(geojson_file, layer_type):
-    with open(geojson_file, "r", encoding="utf-8") as f:
-        geojson_data = json.load(f)
+    def __call__(self, feature):
+        props = feature.get("properties") or {}
+        if self._first:
+            self._first = False
+            if self.layer_type != "projects":
+                self.voltage_field = detect_voltage_field(props)
 
-    for feature in geojson_data["features"]:
-        if not feature["geometry"]:
+        if not feature.get("geometry"):
             print("⚠️ Warning: Feature without geometry ignored.")
-            continue
+            return
 
-        coords = feature["geometry"]["coordinates"]
-        props = feature["properties"]
-        
-        if layer_type == "projects":
+        if self.layer_type == "projects":
             name = props.get("Project_Na", "Unnamed")
             description = (
                 f"🔋 Name: {name}\n"
@@ -74,29 +199,37 @@ def add_features_to_kml(geojson_file, layer_type):
             name = props.get("NAME", "Unnamed")
             description = (
                 f"🔌 Line Name: {name}\n"
-                f"⚡ Voltage: {props.get(voltage_field, 'Unknown')}\n"
+                f"⚡ Voltage: {props.get(self.voltage_field, 'Unknown')}\n"
                 f"🏭 TFO: {props.get('TFO', 'Unknown')}"
             )
 
-        geom_type = feature["geometry"]["type"]
-        if geom_type == "Point":
-            pnt = kml.newpoint(name=name, coords=[(coords[0], coords[1])])
-            pnt.description = description
-        elif geom_type == "LineString":
-            line = kml.newlinestring(name=name, coords=coords)
-            line.description = description
-        elif geom_type == "Polygon":
-            pol = kml.newpolygon(name=name, outerboundaryis=coords[0])
-            pol.description = description
-
-add_features_to_kml(geojson_projects, "projects")
-add_features_to_kml(geojson_lines, "transmission_lines")
-
-kml.save(kml_file)
-print(f"✅ KML file saved: {kml_file}")
-
-with zipfile.ZipFile(kmz_file, "w", zipfile.ZIP_DEFLATED) as kmz:
-    kmz.write(kml_file, os.path.basename(kml_file))
-
-os.remove(kml_file)
-print(f"🎯 KMZ file generated: {kmz_file}")
+        geom = geometry_kml(feature["geometry"])
+        if geom is None:
+            return
+        self.kz.write(PLACEMARK.format(name=html.escape(str(name), quote=False),
+                                       desc=html.escape(description, quote=False), geom=geom))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Descarrega as camadas AESO/AIES (ArcGIS) e gera canada_grid.kmz.")
+    ap.add_argument("--projects-url", default=urls["projects"], help="Endpoint /query da camada de projetos")
+    ap.add_argument("--lines-url", default=urls["transmission_lines"], help="Endpoint /query das linhas de transporte")
+    ap.add_argument("--workers", type=int, default=WORKERS, help="Páginas descarregadas em paralelo")
+    ap.add_argument("--page-size", type=int, default=None, help="Registos por página (default: maxRecordCount do serviço)")
+    args = ap.parse_args()
+
+    workers = max(1, args.workers)
+    session = make_session(workers)
+    # uma só passagem: cada página vai para o .geojsonl e para o KML dentro do KMZ
+    with kmlstream.KmzStream(kmz_file, kml_name=kml_name) as kz:
+        for line in KML_HEAD:
+            kz.write(line)
+        download_data(args.projects_url, geojson_projects, session, workers, args.page_size,
+                      on_feature=PlacemarkWriter(kz, "projects"))
+        download_data(args.lines_url, geojson_lines, session, workers, args.page_size,
+                      on_feature=PlacemarkWriter(kz, "transmission_lines"))
+        kz.write(KML_TAIL)
+    print(f"🎯 KMZ file generated: {kmz_file}")
+
+if __name__ == "__main__":
+    main()
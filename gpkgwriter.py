@@ -0,0 +1,291 @@
+import sqlite3
+import struct
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+WGS84_WKT = (
+    'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,'
+    'AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,'
+    'AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],'
+    'AXIS["Latitude",NORTH],AXIS["Longitude",EAST],AUTHORITY["EPSG","4326"]]'
+)
+RTREE_EXTENSION = "http://www.geopackage.org/spec120/#extension_rtree"
+INSERT_CHUNK = 50_000
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (
+        srs_name TEXT NOT NULL, srs_id INTEGER NOT NULL PRIMARY KEY,
+        organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL,
+        definition TEXT NOT NULL, description TEXT)""",
+    """CREATE TABLE IF NOT EXISTS gpkg_contents (
+        table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL,
+        identifier TEXT UNIQUE, description TEXT DEFAULT '',
+        last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+        min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER,
+        CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id))""",
+    """CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (
+        table_name TEXT NOT NULL, column_name TEXT NOT NULL,
+        geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL,
+        z TINYINT NOT NULL, m TINYINT NOT NULL,
+        CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+        CONSTRAINT uk_gc_table_name UNIQUE (table_name),
+        CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),
+        CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id))""",
+    """CREATE TABLE IF NOT EXISTS gpkg_extensions (
+        table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL,
+        definition TEXT NOT NULL, scope TEXT NOT NULL,
+        CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name))""",
+]
+
+# triggers do rtree (GeoPackage 1.2); as funções ST_* são fornecidas pelo GDAL/QGIS ao editar
+_RTREE_TRIGGERS = [
+    """CREATE TRIGGER "{rt}_insert" AFTER INSERT ON "{t}"
+       WHEN (new."{c}" NOT NULL AND NOT ST_IsEmpty(NEW."{c}"))
+       BEGIN INSERT OR REPLACE INTO "{rt}" VALUES (NEW.fid,
+         ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"), ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}")); END""",
+    """CREATE TRIGGER "{rt}_update1" AFTER UPDATE OF "{c}" ON "{t}"
+       WHEN OLD.fid = NEW.fid AND (NEW."{c}" NOTNULL AND NOT ST_IsEmpty(NEW."{c}"))
+       BEGIN INSERT OR REPLACE INTO "{rt}" VALUES (NEW.fid,
+         ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"), ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}")); END""",
+    """CREATE TRIGGER "{rt}_update2" AFTER UPDATE OF "{c}" ON "{t}"
+       WHEN OLD.fid = NEW.fid AND (NEW."{c}" ISNULL OR ST_IsEmpty(NEW."{c}"))
+       BEGIN DELETE FROM "{rt}" WHERE id = OLD.fid; END""",
+    """CREATE TRIGGER "{rt}_update3" AFTER UPDATE ON "{t}"
+       WHEN OLD.fid != NEW.fid AND (NEW."{c}" NOTNULL AND NOT ST_IsEmpty(NEW."{c}"))
+       BEGIN DELETE FROM "{rt}" WHERE id = OLD.fid;
+         INSERT OR REPLACE INTO "{rt}" VALUES (NEW.fid,
+         ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"), ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}")); END""",
+    """CREATE TRIGGER "{rt}_update4" AFTER UPDATE ON "{t}"
+       WHEN OLD.fid != NEW.fid AND (NEW."{c}" ISNULL OR ST_IsEmpty(NEW."{c}"))
+       BEGIN DELETE FROM "{rt}" WHERE id IN (OLD.fid, NEW.fid); END""",
+    """CREATE TRIGGER "{rt}_delete" AFTER DELETE ON "{t}"
+       WHEN old."{c}" NOT NULL
+       BEGIN DELETE FROM "{rt}" WHERE id = OLD.fid; END""",
+]
+
+
+def _q(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def point_geometry(x, y, srs_id: int = 4326):
+    """
+    Geometrias GPKG (header 'GP' + WKB Point) para arrays de x/y, montadas de uma
+    vez com um array estruturado NumPy. Devolve (blobs, bounds) — bounds em
+    (minx, miny, maxx, maxy), NaN para pontos vazios.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    empty = ~(np.isfinite(x) & np.isfinite(y))
+    rec = np.zeros(len(x), dtype=[
+        ("magic", "S2"), ("version", "u1"), ("flags", "u1"), ("srs_id", "<i4"),
+        ("order", "u1"), ("wkb_type", "<u4"), ("x", "<f8"), ("y", "<f8"),
+    ])
+    rec["magic"] = b"GP"
+    rec["flags"] = np.where(empty, 0x11, 0x01)  # little endian, sem envelope (+ flag vazio)
+    rec["srs_id"] = srs_id
+    rec["order"] = 1
+    rec["wkb_type"] = 1
+    rec["x"] = np.where(empty, np.nan, x)
+    rec["y"] = np.where(empty, np.nan, y)
+
+    size = rec.dtype.itemsize
+    buf = rec.tobytes()
+    blobs = np.empty(len(x), dtype=object)
+    blobs[:] = [buf[i:i + size] for i in range(0, len(buf), size)]
+    bounds = np.column_stack([rec["x"], rec["y"], rec["x"], rec["y"]])
+    return blobs, bounds
+
+
+def shape_geometry(geoms, srs_id: int = 4326):
+    """Geometrias GPKG (header com envelope XY + WKB) a partir de um array de geometrias shapely."""
+    import shapely
+
+    geoms = np.asarray(geoms, dtype=object)
+    wkbs = shapely.to_wkb(geoms, byte_order=1, output_dimension=2, flavor="iso")
+    bounds = shapely.bounds(geoms)
+    empty = shapely.is_empty(geoms) | shapely.is_missing(geoms)
+    blobs = np.empty(len(geoms), dtype=object)
+    for i, (wkb, (minx, miny, maxx, maxy), is_empty) in enumerate(zip(wkbs, bounds, empty)):
+        if wkb is None:
+            blobs[i] = None
+        elif is_empty:
+            blobs[i] = struct.pack("<2sBBi", b"GP", 0, 0x11, srs_id) + wkb
+        else:
+            blobs[i] = struct.pack("<2sBBi4d", b"GP", 0, 0x03, srs_id, minx, maxx, miny, maxy) + wkb
+    return blobs, bounds
+
+
+def _column(s: pd.Series):
+    """(tipo SQL, valores Python) de uma coluna; NaN/NA → NULL."""
+    kind = s.dtype.kind
+    if kind == "M":
+        if getattr(s.dt, "tz", None) is not None:
+            s = s.dt.tz_convert("UTC").dt.tz_localize(None)
+            suffix = "Z"
+        else:
+            suffix = ""
+        vals = [None if pd.isna(v) else v.isoformat(timespec="milliseconds") + suffix for v in s]
+        return "DATETIME", vals
+    typ = {"b": "BOOLEAN", "i": "INTEGER", "u": "INTEGER", "f": "REAL"}.get(kind)
+    if typ:
+        return typ, s.astype(object).where(s.notna(), None).tolist()
+    mask = s.isna().to_numpy()
+    return "TEXT", [None if m else str(v) for v, m in zip(s, mask)]
+
+
+class GpkgWriter:
+    """
+    GeoPackage escrito diretamente com sqlite3: todas as camadas na mesma ligação
+    e transação, inserts em bloco e índices espaciais (rtree) criados uma só vez
+    no fecho. `timings` guarda o tempo de escrita de cada camada.
+
+        with GpkgWriter("out.gpkg") as gw:
+            blobs, bounds = point_geometry(df["Longitude"], df["Latitude"])
+            gw.write_layer("pontos", df, blobs, bounds, "POINT")
+
+    Para tabelas muito grandes, `write_layer` com o primeiro bloco e
+    `append_layer` com os seguintes (os tipos vêm do dtype, igual em todos).
+    """
+
+    def __init__(self, path, overwrite: bool = True):
+        self.path = Path(path)
+        if overwrite and self.path.exists():
+            self.path.unlink()
+        self.timings = {}
+        self._pending_index = {}
+        self._inserts = {}
+        self.conn = sqlite3.connect(str(self.path), isolation_level=None)
+        self.conn.execute("PRAGMA application_id = 1196444487")  # 'GPKG'
+        self.conn.execute("PRAGMA user_version = 10200")
+        self.conn.execute("PRAGMA cache_size = -262144")  # até 256 MB de páginas: o rtree de camadas grandes cabe em memória
+        self.conn.execute("BEGIN")
+        for sql in _SCHEMA:
+            self.conn.execute(sql)
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)",
+            [("Undefined cartesian SRS", -1, "NONE", -1, "undefined", None),
+             ("Undefined geographic SRS", 0, "NONE", 0, "undefined", None),
+             ("WGS 84 geodetic", 4326, "EPSG", 4326, WGS84_WKT, None)],
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.conn.execute("ROLLBACK")
+            self.conn.close()
+        return False
+
+    def layers(self):
+        return [r[0] for r in self.conn.execute("SELECT table_name FROM gpkg_contents")]
+
+    def _ensure_srs(self, srs_id: int):
+        if self.conn.execute("SELECT 1 FROM gpkg_spatial_ref_sys WHERE srs_id = ?", (srs_id,)).fetchone():
+            return
+        try:
+            from pyproj import CRS
+            crs = CRS.from_epsg(srs_id)
+            name, wkt = crs.name, crs.to_wkt("WKT1_GDAL")
+        except Exception:
+            name, wkt = f"EPSG:{srs_id}", "undefined"
+        self.conn.execute("INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, 'EPSG', ?, ?, NULL)",
+                          (name, srs_id, srs_id, wkt))
+
+    def delete_layer(self, layer: str):
+        row = self.conn.execute("SELECT column_name FROM gpkg_geometry_columns WHERE table_name = ?",
+                                (layer,)).fetchone()
+        geom_col = row[0] if row else "geom"
+        self.conn.execute(f"DROP TABLE IF EXISTS {_q(f'rtree_{layer}_{geom_col}')}")
+        self.conn.execute(f"DROP TABLE IF EXISTS {_q(layer)}")
+        metas = ["gpkg_extensions", "gpkg_geometry_columns", "gpkg_contents"]
+        if self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'gpkg_ogr_contents'").fetchone():
+            metas.insert(0, "gpkg_ogr_contents")  # tabela auxiliar do GDAL (ficheiros gerados com geopandas)
+        for meta in metas:
+            self.conn.execute(f"DELETE FROM {meta} WHERE table_name = ?", (layer,))
+        self._pending_index.pop(layer, None)
+        self._inserts.pop(layer, None)
+
+    def write_layer(self, layer: str, df: pd.DataFrame, blobs, bounds,
+                    geometry_type: str = "GEOMETRY", srs_id: int = 4326):
+        """Cria (ou substitui) a camada `layer` com os atributos de `df` e as geometrias `blobs`."""
+        t0 = time.perf_counter()
+        self.delete_layer(layer)
+        self._ensure_srs(srs_id)
+
+        cols = [(name, *_column(df[name])) for name in df.columns if str(name).lower() not in ("fid", "geom")]
+        col_defs = "".join(f", {_q(name)} {typ}" for name, typ, _ in cols)
+        self.conn.execute(f"CREATE TABLE {_q(layer)} (fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, "
+                          f"geom {geometry_type}{col_defs})")
+
+        self.conn.execute(
+            "INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) "
+            "VALUES (?, 'features', ?, ?)", (layer, layer, srs_id))
+        self.conn.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', ?, ?, 0, 0)",
+                          (layer, geometry_type, srs_id))
+
+        placeholders = ", ".join("?" * (len(cols) + 2))
+        sql = f"INSERT INTO {_q(layer)} (fid, geom{''.join(', ' + _q(n) for n, _, _ in cols)}) VALUES ({placeholders})"
+        self._inserts[layer] = (sql, [name for name, _, _ in cols], 0)
+        self._pending_index[layer] = []
+        self._insert(layer, [v for _, _, v in cols], blobs, bounds)
+        self.timings[layer] = time.perf_counter() - t0
+
+    def append_layer(self, layer: str, df: pd.DataFrame, blobs, bounds):
+        """Acrescenta linhas a uma camada criada nesta ligação com `write_layer` (mesmas colunas)."""
+        t0 = time.perf_counter()
+        if layer not in self._inserts:
+            raise KeyError(f"Camada não criada nesta ligação: {layer}")
+        names = self._inserts[layer][1]
+        self._insert(layer, [_column(df[name])[1] for name in names], blobs, bounds)
+        self.timings[layer] = self.timings.get(layer, 0.0) + time.perf_counter() - t0
+
+    def _insert(self, layer: str, values, blobs, bounds):
+        sql, names, count = self._inserts[layer]
+        blobs = list(blobs)
+        for start in range(0, len(blobs), INSERT_CHUNK):
+            end = start + INSERT_CHUNK
+            self.conn.executemany(sql, zip(range(count + start + 1, count + min(end, len(blobs)) + 1),
+                                           blobs[start:end], *(v[start:end] for v in values)))
+        self._inserts[layer] = (sql, names, count + len(blobs))
+
+        bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+        self._pending_index[layer].append(bounds)
+        if len(bounds) and not np.isnan(bounds).all():
+            # extensão acumulada: min/max com o que já está em gpkg_contents (NULL na 1.ª vez)
+            self.conn.execute(
+                "UPDATE gpkg_contents SET min_x = min(coalesce(min_x, ?1), ?1), min_y = min(coalesce(min_y, ?2), ?2), "
+                "max_x = max(coalesce(max_x, ?3), ?3), max_y = max(coalesce(max_y, ?4), ?4) WHERE table_name = ?5",
+                (float(np.nanmin(bounds[:, 0])), float(np.nanmin(bounds[:, 1])),
+                 float(np.nanmax(bounds[:, 2])), float(np.nanmax(bounds[:, 3])), layer))
+
+    def _build_index(self, layer: str, bounds):
+        bounds = np.concatenate(bounds) if bounds else np.empty((0, 4))
+        rt = f"rtree_{layer}_geom"
+        self.conn.execute(f"CREATE VIRTUAL TABLE {_q(rt)} USING rtree(id, minx, maxx, miny, maxy)")
+        ok = ~np.isnan(bounds).any(axis=1)
+        fids = np.arange(1, len(bounds) + 1)[ok]
+        b = bounds[ok]
+        self.conn.executemany(f"INSERT INTO {_q(rt)} VALUES (?, ?, ?, ?, ?)",
+                              zip(fids.tolist(), b[:, 0].tolist(), b[:, 2].tolist(), b[:, 1].tolist(), b[:, 3].tolist()))
+        self.conn.execute("INSERT INTO gpkg_extensions VALUES (?, 'geom', 'gpkg_rtree_index', ?, 'write-only')",
+                          (layer, RTREE_EXTENSION))
+        for trg in _RTREE_TRIGGERS:
+            self.conn.execute(trg.format(rt=rt.replace('"', '""'), t=layer.replace('"', '""'), c="geom"))
+
+    def close(self):
+        for layer, bounds in self._pending_index.items():
+            t0 = time.perf_counter()
+            self._build_index(layer, bounds)
+            self.timings[layer] = self.timings.get(layer, 0.0) + time.perf_counter() - t0
+        self._pending_index = {}
+        self._inserts = {}
+        self.conn.execute("COMMIT")
+        self.conn.close()
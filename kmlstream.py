@@ -0,0 +1,116 @@
+import html
+import io
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+
+CHUNK_ROWS = 5000  # linhas formatadas de cada vez (memória constante)
+TABLE_OPEN = "<table border='1' cellpadding='3' cellspacing='0'>"
+
+
+class KmzStream:
+    """
+    Escreve o KML diretamente dentro do KMZ (ZipFile.open(..., "w")), elemento a
+    elemento, sem montar o documento em memória. Os ficheiros extra (ícones) são
+    adicionados ao zip depois de fechado o KML. O zip é escrito em `<path>.part`
+    e só substitui `path` se o bloco terminar sem exceção — um erro a meio não
+    deixa um KMZ cortado com ar de completo.
+
+        with KmzStream(path) as kz:
+            kz.write('<?xml ...>')
+            write_placemarks(kz, TEMPLATE, name=..., lon=..., lat=...)
+            kz.add_file("ON.png", "ON.png")
+    """
+
+    def __init__(self, kmz_path, kml_name: str = "doc.kml", sep: str = "\n"):
+        self.kmz_path = kmz_path
+        self.kml_name = kml_name
+        self.sep = sep
+        self._extra = []
+
+    def __enter__(self):
+        self._tmp = f"{self.kmz_path}.part"
+        self._zf = zipfile.ZipFile(self._tmp, "w", compression=zipfile.ZIP_DEFLATED)
+        self._out = io.TextIOWrapper(self._zf.open(self.kml_name, "w"), encoding="utf-8", newline="")
+        self._first = True
+        return self
+
+    def write(self, text: str):
+        """Escreve um elemento; `sep` vai entre elementos (como um "sep".join)."""
+        if not self._first:
+            self._out.write(self.sep)
+        self._out.write(text)
+        self._first = False
+
+    def add_file(self, path, arcname: str):
+        self._extra.append((path, arcname, None))
+
+    def add_bytes(self, arcname: str, data: bytes):
+        self._extra.append((None, arcname, data))
+
+    def __exit__(self, exc_type, exc, tb):
+        ok = False
+        try:
+            self._out.close()
+            if exc_type is None:
+                for path, arcname, data in self._extra:
+                    if data is None:
+                        self._zf.write(path, arcname)
+                    else:
+                        self._zf.writestr(arcname, data)
+                ok = True
+        finally:
+            self._zf.close()
+            if ok:
+                os.replace(self._tmp, self.kmz_path)
+            else:
+                try:
+                    os.remove(self._tmp)
+                except FileNotFoundError:
+                    pass
+        return False
+
+
+def iter_chunks(df: pd.DataFrame, size: int = CHUNK_ROWS):
+    for start in range(0, len(df), size):
+        yield df.iloc[start:start + size]
+
+
+def safe_col(s: pd.Series) -> pd.Series:
+    """Versão por coluna de _safe(): NaN → "", resto str() + html.escape."""
+    return s.map(str).map(html.escape).where(s.notna(), "")
+
+
+def latlon_col(lat, lon) -> list:
+    return [f"{float(a):.6f}, {float(b):.6f}" for a, b in zip(lat, lon)]
+
+
+def tr(label: str, cells) -> pd.Series:
+    """Uma linha <tr> por registo; `label` entra tal como vem (escapar antes se preciso)."""
+    return f"<tr><th align='left'>{label}</th><td>" + pd.Series(cells, dtype=object) + "</td></tr>"
+
+
+def table(rows) -> pd.Series:
+    """Junta as colunas <tr> numa tabela HTML por registo (concatenação vetorizada)."""
+    acc = TABLE_OPEN
+    for r in rows:
+        acc = acc + pd.Series(r, dtype=object).values
+    return pd.Series(acc + "</table>", dtype=object)
+
+
+def cdata(s: pd.Series) -> pd.Series:
+    return "<![CDATA[" + s + "]]>"
+
+
+def style_col(flag, on: str, off: str):
+    return np.where(np.asarray(flag, dtype=bool), on, off)
+
+
+def write_placemarks(kz: KmzStream, template: str, **columns):
+    """Formata `template` (str.format) uma vez por linha a partir de colunas alinhadas."""
+    keys = list(columns)
+    for vals in zip(*columns.values()):
+        kz.write(template.format_map(dict(zip(keys, vals))))
@@ -1,8 +1,18 @@
 import googlemaps
+import numpy as np
 import pandas as pd
+import asyncio
+import hashlib
+import json
+import math
+import random
+import sqlite3
 import time
 import os
 import folium
+from folium.plugins import FastMarkerCluster, HeatMap
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from tqdm import tqdm
 
 # === Config ===
@@ -12,6 +22,36 @@ gmaps = googlemaps.Client(key=API_KEY)
 OUTPUT_FOLDER = r"C:"
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
+# === Throughput ===
+QPS = 10               # requests per second allowed by the Places quota (all calls share it)
+MAX_CONCURRENCY = 8    # requests in flight at the same time
+PAGE_TOKEN_DELAY = 2.0 # Google requires ~2s before a next_page_token becomes valid
+# === Map rendering ===
+# Up to MAP_MARKER_BUDGET places: plain markers with popups; up to
+# MAP_CLUSTER_BUDGET: clustered markers; above that: heatmap.
+MAP_MARKER_BUDGET = 2000
+MAP_CLUSTER_BUDGET = 50000
+
+# === Query planning ===
+# Nearby points share one search circle when it only needs to grow a little:
+# circle radius = radius + spread of the points, at most +COVER_MAX_GROWTH and
+# never above the API limit (bigger circles hit the 60-result cap sooner).
+# A shared search that comes back full (NEARBY_MAX_RESULTS, i.e. 3 pages) may have
+# dropped places, so that keyword is searched again from each member point.
+PLAN_COVER = True
+COVER_MAX_GROWTH = 0.25
+MAX_SEARCH_RADIUS = 50000
+NEARBY_MAX_RESULTS = 60
+
+# === Cache (SQLite, survives between runs) ===
+PLACES_CACHE = os.path.join(OUTPUT_FOLDER, "places_cache.sqlite")
+DETAILS_TTL_DAYS = 30  # phone/website/ratings change slowly
+NEARBY_TTL_DAYS = 7    # which places a search returns changes faster
+DETAIL_FIELDS = [
+    "name", "formatted_address", "formatted_phone_number",
+    "website", "geometry", "rating", "user_ratings_total"
+]
+
 # === Category catalog ===
 # Keep "Real Estate Agencies" and add associations (now including Parish Councils & Livestock Associations).
 # For associations, use multi-language keywords (EN/PT/ES).
@@ -107,128 +147,470 @@ def get_points():
             print("❌ Invalid coordinates. Please enter numeric values.")
     return points
 
-def fetch_place_details(pid):
-    """Fetch place details (fields we need)."""
-    try:
-        details = gmaps.place(
-            place_id=pid,
-            fields=[
-                "name", "formatted_address", "formatted_phone_number",
-                "website", "geometry", "rating", "user_ratings_total"
-            ]
-        )["result"]
-        return {
-            "Name": details.get("name"),
-            "Address": details.get("formatted_address"),
-            "Phone": details.get("formatted_phone_number"),
-            "Website": details.get("website"),
-            "Latitude": details.get("geometry", {}).get("location", {}).get("lat"),
-            "Longitude": details.get("geometry", {}).get("location", {}).get("lng"),
-            "Rating": details.get("rating"),
-            "Total Ratings": details.get("user_ratings_total"),
-        }
-    except Exception as e:
-        print(f"   ⚠️ Error fetching details for {pid}: {e}")
-        return None
+def details_record(details):
+    """Map a Places details result to our output columns."""
+    return {
+        "Name": details.get("name"),
+        "Address": details.get("formatted_address"),
+        "Phone": details.get("formatted_phone_number"),
+        "Website": details.get("website"),
+        "Latitude": details.get("geometry", {}).get("location", {}).get("lat"),
+        "Longitude": details.get("geometry", {}).get("location", {}).get("lng"),
+        "Rating": details.get("rating"),
+        "Total Ratings": details.get("user_ratings_total"),
+    }
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters (NumPy, broadcasts)."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371008.8 * np.arcsin(np.sqrt(a))
+
+def plan_cover(points, radius, max_growth=COVER_MAX_GROWTH, max_radius=MAX_SEARCH_RADIUS):
+    """
+    Greedy cover of the search disks of `points`: list of
+    (lat, lon, search_radius, member_indices). A circle centered at the
+    members' centroid with radius `radius` + max distance to a member contains
+    every member's disk. Isolated points keep their own (lat, lon, radius).
+    """
+    pts = np.asarray(points, dtype=float).reshape(-1, 2)
+    limit = min(radius * (1 + max_growth), max_radius)
+    reach = 2 * (limit - radius)  # members further apart than this can never share a circle
+    dist = haversine_m(pts[:, None, 0], pts[:, None, 1], pts[None, :, 0], pts[None, :, 1])
+
+    left = list(range(len(pts)))
+    circles = []
+    while left:
+        # seed with the point that has the most candidates around it
+        seed = max(left, key=lambda i: (int(np.sum(dist[i, left] <= reach)), -i))
+        members = [seed]
+        for j in sorted(left, key=lambda j: dist[seed, j]):
+            if j == seed or dist[seed, j] > reach:
+                continue
+            trial = members + [j]
+            c = pts[trial].mean(axis=0)
+            if radius + haversine_m(c[0], c[1], pts[trial, 0], pts[trial, 1]).max() <= limit:
+                members = trial
+        if len(members) == 1:
+            circles.append((float(pts[seed, 0]), float(pts[seed, 1]), radius, members))
+        else:
+            c = pts[members].mean(axis=0)
+            spread = haversine_m(c[0], c[1], pts[members, 0], pts[members, 1]).max()
+            circles.append((float(c[0]), float(c[1]), int(math.ceil(radius + spread)), sorted(members)))
+        left = [i for i in left if i not in members]
+    return sorted(circles, key=lambda c: c[3][0])
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class PlacesCache:
+    """
+    Persistent cache of Places responses in SQLite: details by place_id and
+    nearby-search results (all pages) by (location, radius, keyword, type).
+    Entries older than their TTL are ignored and purged on open.
+    """
 
-def search_places_generic(lat, lon, radius, keywords, place_type=None, category_label=""):
+    def __init__(self, path=PLACES_CACHE, details_ttl_days=DETAILS_TTL_DAYS, nearby_ttl_days=NEARBY_TTL_DAYS):
+        self.ttl = {"details": details_ttl_days * 86400, "nearby": nearby_ttl_days * 86400}
+        self.hits = {"details": 0, "nearby": 0}
+        self.conn = sqlite3.connect(path)
+        for table in self.ttl:
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, fetched REAL NOT NULL, payload TEXT NOT NULL)")
+            self.conn.execute(f"DELETE FROM {table} WHERE fetched < ?", (time.time() - self.ttl[table],))
+        self.conn.commit()
+
+    @staticmethod
+    def nearby_key(lat, lon, radius, keyword=None, place_type=None):
+        return json.dumps([round(lat, 6), round(lon, 6), radius, keyword, place_type])
+
+    def get(self, table, key):
+        row = self.conn.execute(f"SELECT payload FROM {table} WHERE key = ? AND fetched >= ?",
+                                (key, time.time() - self.ttl[table])).fetchone()
+        if row is None:
+            return None
+        self.hits[table] += 1
+        return json.loads(row[0])
+
+    def put(self, table, key, value):
+        self.conn.execute(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?)",
+                          (key, time.time(), json.dumps(value, ensure_ascii=False)))
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+class PlacesEngine:
     """
-    Search by a list of keywords (or type when available).
-    Handles pagination (next_page_token) to collect more results.
+    Runs Places searches concurrently. The googlemaps client is synchronous, so
+    calls go to a thread pool; a token bucket keeps the total call rate within
+    QPS and a semaphore caps requests in flight. Pagination waits are
+    asyncio sleeps, so other searches keep running meanwhile. With a
+    PlacesCache, cached responses are used instead of API calls.
     """
-    results = []
-    seen = set()
 
-    def run_query(keyword_or_none):
+    def __init__(self, client, qps=QPS, concurrency=MAX_CONCURRENCY, cache=None):
+        self.client = client
+        self.cache = cache
+        self.bucket = TokenBucket(qps)
+        self.sem = asyncio.Semaphore(concurrency)
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+        self.calls = 0
+
+    async def _call(self, fn, **kwargs):
+        # token taken once a slot is free, so queued calls don't burn the
+        # bucket and then burst past the quota when slots open up
+        async with self.sem:
+            await self.bucket.acquire()
+            self.calls += 1
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.pool, partial(fn, **kwargs))
+
+    async def nearby(self, lat, lon, radius, keyword=None, place_type=None):
+        """All result pages (up to 3, ~60 places) of one nearby search."""
+        key = PlacesCache.nearby_key(lat, lon, radius, keyword, place_type)
+        if self.cache:
+            cached = self.cache.get("nearby", key)
+            if cached is not None:
+                return cached
+        out, complete = await self._nearby(lat, lon, radius, keyword, place_type)
+        if self.cache and complete:
+            # only the place_id and location are used downstream; keep the cache small
+            self.cache.put("nearby", key, [
+                {"place_id": p.get("place_id"), "location": p.get("geometry", {}).get("location")}
+                for p in out
+            ])
+        return out
+
+    async def _nearby(self, lat, lon, radius, keyword=None, place_type=None):
+        """(results, complete) — complete is False if any page failed (then nothing is cached)."""
+        kwargs = {"location": (lat, lon), "radius": radius}
+        if place_type:
+            kwargs["type"] = place_type
+        if keyword:
+            kwargs["keyword"] = keyword
         try:
-            kwargs = {
-                "location": (lat, lon),
-                "radius": radius,
-            }
-            if place_type:
-                kwargs["type"] = place_type
-            if keyword_or_none:
-                kwargs["keyword"] = keyword_or_none
-
-            response = gmaps.places_nearby(**kwargs)
+            response = await self._call(self.client.places_nearby, **kwargs)
         except Exception as e:
-            print(f"⚠️ Search error ({keyword_or_none}): {e}")
-            return []
+            print(f"⚠️ Search error ({keyword}): {e}")
+            return [], False
 
-        data = response.get("results", [])
+        out = list(response.get("results", []))
         token = response.get("next_page_token")
-
-        out = list(data)
-
         # Up to 2 extra pages (Google may return up to ~60 results)
         for _ in range(2):
             if not token:
                 break
-            time.sleep(2.0)  # Google requires ~2s before using page_token
+            await asyncio.sleep(PAGE_TOKEN_DELAY)
             try:
-                response = gmaps.places_nearby(page_token=token)
+                response = await self._call(self.client.places_nearby, page_token=token)
                 out.extend(response.get("results", []))
                 token = response.get("next_page_token")
             except Exception as e:
                 print(f"⚠️ Pagination error: {e}")
-                break
-
-        return out
-
-    # With type (real estate): one call is enough
-    if place_type:
-        batches = [run_query(keywords[0] if keywords else None)]
-    else:
+                return out, False
+        return out, True
+
+    async def details(self, pid):
+        if self.cache:
+            cached = self.cache.get("details", pid)
+            if cached is not None:
+                return cached
+        try:
+            response = await self._call(self.client.place, place_id=pid, fields=DETAIL_FIELDS)
+            record = details_record(response["result"])
+        except Exception as e:
+            print(f"   ⚠️ Error fetching details for {pid}: {e}")
+            return None
+        if self.cache:
+            self.cache.put("details", pid, record)
+        return record
+
+    async def details_many(self, pids):
+        """Details for each distinct place_id, fetched concurrently; {pid: record or None}."""
+        pids = list(dict.fromkeys(pids))
+        return dict(zip(pids, await asyncio.gather(*(self.details(pid) for pid in pids))))
+
+    @staticmethod
+    def queries(keywords, place_type=None):
+        if place_type:
+            # With type (real estate): one call is enough
+            return [keywords[0] if keywords else None]
         # Associations: iterate keywords to broaden coverage
-        batches = []
-        for kw in keywords:
-            batches.append(run_query(kw))
-            time.sleep(0.3)  # small pause to be gentle on quotas
-
-    # Aggregate
-    for batch in batches:
-        for place in batch or []:
-            pid = place.get("place_id")
-            if not pid or pid in seen:
+        return list(keywords)
+
+    @staticmethod
+    def merge_hits(batches):
+        """{place_id: (lat, lng) or None} over several result lists, first occurrence order."""
+        hits = {}
+        for batch in batches:
+            for place in batch or []:
+                pid = place.get("place_id")
+                if not pid or pid in hits:
+                    continue
+                loc = place.get("location") or place.get("geometry", {}).get("location")
+                hits[pid] = (loc["lat"], loc["lng"]) if loc else None
+        return hits
+
+    async def batches(self, lat, lon, radius, keywords, place_type=None):
+        """One nearby() result list per query of a category (see queries())."""
+        return await asyncio.gather(*(self.nearby(lat, lon, radius, kw, place_type)
+                                      for kw in self.queries(keywords, place_type)))
+
+    async def place_hits(self, lat, lon, radius, keywords, place_type=None):
+        """{place_id: (lat, lng) or None} found around one point for one category, in result order."""
+        return self.merge_hits(await self.batches(lat, lon, radius, keywords, place_type))
+
+    async def search(self, lat, lon, radius, keywords, place_type=None, category_label=""):
+        """Async search_places_generic(): keyword queries and details calls run concurrently."""
+        pids = list(await self.place_hits(lat, lon, radius, keywords, place_type))
+        details = await self.details_many(pids)
+        return [
+            {"Place ID": pid, **details[pid], "Category": category_label, "Search Origin": f"{lat}, {lon}"}
+            for pid in pids if details[pid]
+        ]
+
+    async def run(self, points, choices, radius, plan=PLAN_COVER):
+        """
+        Every point × category, concurrently; results keep the serial (point,
+        category) order. With `plan`, clustered points are searched through a
+        shared circle (plan_cover) and each place goes back to the origins
+        within `radius` of it. All searches finish first so that each distinct
+        place_id gets a single details lookup across points and categories.
+        """
+        if plan:
+            circles = plan_cover(points, radius)
+        else:
+            circles = [(lat, lon, radius, [i]) for i, (lat, lon) in enumerate(points)]
+        per_category = {c: len(self.queries(CATEGORIES[c]["keywords"], CATEGORIES[c]["place_type"])) for c in choices}
+        saved = (len(points) - len(circles)) * sum(per_category.values())
+
+        jobs = [(circle, c) for circle in circles for c in choices]
+        tasks = [
+            asyncio.ensure_future(self.batches(lat, lon, r, CATEGORIES[c]["keywords"], CATEGORIES[c]["place_type"]))
+            for (lat, lon, r, _), c in jobs
+        ]
+        with tqdm(total=len(tasks), desc="🔄 Searching", unit="search") as bar:
+            for fut in asyncio.as_completed(tasks):
+                await fut
+                bar.update(1)
+
+        # shared circles whose search hit the result cap: that query again from each member
+        redo = {}
+        for n, (((_, _, _, members), c), task) in enumerate(zip(jobs, tasks)):
+            if len(members) == 1:
                 continue
-            seen.add(pid)
-            details = fetch_place_details(pid)
-            if not details:
-                continue
-            record = {
-                "Place ID": pid,
-                **details,
-                "Category": category_label,
-                "Search Origin": f"{lat}, {lon}",
-            }
-            results.append(record)
-            time.sleep(0.1)  # brief pause between detail calls
-
-    return results
-
-def generate_map(data, output_html):
+            queries = self.queries(CATEGORIES[c]["keywords"], CATEGORIES[c]["place_type"])
+            for q, batch in enumerate(task.result()):
+                if len(batch) >= NEARBY_MAX_RESULTS:
+                    for i in members:
+                        lat, lon = points[i]
+                        redo[n, i, q] = asyncio.ensure_future(
+                            self.nearby(lat, lon, radius, queries[q], CATEGORIES[c]["place_type"]))
+        if redo:
+            with tqdm(total=len(redo), desc="🔁 Re-searching full circles", unit="search") as bar:
+                for fut in asyncio.as_completed(list(redo.values())):
+                    await fut
+                    bar.update(1)
+        # both in nearby searches (one query from one origin): net = per-point searches avoided
+        net = saved - len(redo)
+        if plan and (saved or redo):
+            rerun = f"{len(redo)} re-run per point after a full circle"
+            if net >= 0:
+                print(f"🧭 {len(points)} points → {len(circles)} search circles "
+                      f"({net} nearby searches saved" + (f"; {rerun})" if redo else ")"))
+            else:
+                print(f"🧭 {len(points)} points → {len(circles)} search circles "
+                      f"(no searches saved — {-net} extra: {rerun})")
+
+        # back to (origin, category); shared circles keep only places within radius of the origin
+        found = {}
+        for n, (((_, _, _, members), c), task) in enumerate(zip(jobs, tasks)):
+            batches = task.result()
+            for i in members:
+                if len(members) == 1:
+                    found[i, c] = list(self.merge_hits(batches))
+                    continue
+                lat, lon = points[i]
+                per_origin = []
+                for q, batch in enumerate(batches):
+                    if (n, i, q) in redo:
+                        per_origin.append(redo[n, i, q].result())
+                        continue
+                    hits = self.merge_hits([batch])
+                    per_origin.append([
+                        {"place_id": pid, "location": {"lat": loc[0], "lng": loc[1]} if loc else None}
+                        for pid, loc in hits.items()
+                        if loc is None or haversine_m(lat, lon, loc[0], loc[1]) <= radius
+                    ])
+                found[i, c] = list(self.merge_hits(per_origin))
+
+        unique = list(dict.fromkeys(pid for pids in found.values() for pid in pids))
+        print(f"📍 {sum(map(len, found.values()))} hits → {len(unique)} distinct places")
+        details = await self.details_many(unique)
+        self.pool.shutdown(wait=False)
+        return [
+            {"Place ID": pid, **details[pid], "Category": CATEGORIES[c]["label"], "Search Origin": f"{lat}, {lon}"}
+            for i, (lat, lon) in enumerate(points) for c in choices for pid in found[i, c] if details[pid]
+        ]
+
+
+class FakePlacesClient:
+    """
+    Offline stand-in for googlemaps.Client (places_nearby / place) for testing
+    the engine without an API key. A fixed random set of `pool` places is
+    scattered over Portugal; each place matches ~1/4 of keywords/types. Nearby
+    searches return the matching places within the radius, nearest first,
+    capped at 60 and split in pages of 20 with page tokens. `latency`
+    simulates the network round trip.
+    """
+
+    def __init__(self, latency=0.05, pool=3000, seed=0):
+        rng = random.Random(seed)
+        self.latency = latency
+        self.places = [(rng.uniform(37.0, 42.0), rng.uniform(-9.5, -6.2)) for _ in range(pool)]
+        self.lat = np.array([p[0] for p in self.places])
+        self.lon = np.array([p[1] for p in self.places])
+        self.calls = {"places_nearby": 0, "place": 0}
+        self._pages = {}
+
+    def places_nearby(self, location=None, radius=None, keyword=None, type=None, page_token=None):
+        time.sleep(self.latency)
+        self.calls["places_nearby"] += 1
+        if page_token:
+            ids, page = self._pages.pop(page_token)
+        else:
+            d = haversine_m(location[0], location[1], self.lat, self.lon)
+            tag = f"{keyword}|{type}"
+            ids = [int(n) for n in np.argsort(d, kind="stable")
+                   if d[n] <= radius and hashlib.md5(f"{tag}|{n}".encode()).digest()[0] < 64][:60]
+            page = 0
+        response = {"results": [
+            {"place_id": f"fake_{n}", "geometry": {"location": {"lat": self.places[n][0], "lng": self.places[n][1]}}}
+            for n in ids[page * 20:(page + 1) * 20]
+        ]}
+        if (page + 1) * 20 < len(ids):
+            token = hashlib.md5(f"{ids}|{page}".encode()).hexdigest()
+            self._pages[token] = (ids, page + 1)
+            response["next_page_token"] = token
+        return response
+
+    def place(self, place_id=None, fields=None):
+        time.sleep(self.latency)
+        self.calls["place"] += 1
+        n = int(place_id.rsplit("_", 1)[1])
+        return {"result": {
+            "name": f"Fake place {n}",
+            "formatted_address": f"Rua {n}, Portugal",
+            "geometry": {"location": {"lat": self.places[n][0], "lng": self.places[n][1]}},
+            "rating": round(3 + (n % 20) / 10, 1),
+            "user_ratings_total": n,
+        }}
+
+
+def search_places_generic(lat, lon, radius, keywords, place_type=None, category_label=""):
+    """
+    Search by a list of keywords (or type when available).
+    Handles pagination (next_page_token) to collect more results.
+    """
+    cache = PlacesCache()
+    engine = PlacesEngine(gmaps, cache=cache)
+    try:
+        return asyncio.run(engine.search(lat, lon, radius, keywords, place_type, category_label))
+    finally:
+        engine.pool.shutdown()
+        cache.close()
+
+# popup/tooltip bound per feature in the browser (one GeoJSON layer per category)
+_BIND_POPUP = folium.JsCode(
+    "function (feature, layer) {"
+    " layer.bindPopup(feature.properties.popup);"
+    " layer.bindTooltip(feature.properties.tooltip); }"
+)
+_CLUSTER_MARKER = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindPopup(row[2]);
+    marker.bindTooltip(row[3]);
+    return marker;
+}
+"""
+
+def _text_col(data, col):
+    if col not in data.columns:
+        return pd.Series("", index=data.index)
+    return data[col].fillna("").astype(str)
+
+def map_mode(n):
+    if n <= MAP_MARKER_BUDGET:
+        return "markers"
+    return "cluster" if n <= MAP_CLUSTER_BUDGET else "heatmap"
+
+def generate_map(data, output_html, mode="auto"):
+    """
+    One toggleable layer per category (LayerControl), built from column arrays.
+    `mode` = "markers" | "cluster" | "heatmap"; "auto" picks by result count.
+    """
+    data = data.dropna(subset=["Latitude", "Longitude"]) if not data.empty else data
     if data.empty:
         print("⚠️ No data to render on the map.")
         return
 
+    mode = map_mode(len(data)) if mode == "auto" else mode
+
     # Initial viewport
     first_lat = data.iloc[0]["Latitude"]
     first_lon = data.iloc[0]["Longitude"]
     m = folium.Map(location=[first_lat, first_lon], zoom_start=12)
 
-    # Markers
-    for _, row in data.iterrows():
-        popup_txt = f"{row.get('Name','')}<br>{row.get('Address','')}"
-        if "Category" in data.columns:
-            popup_txt += f"<br><b>{row.get('Category','')}</b>"
-        folium.Marker(
-            location=[row["Latitude"], row["Longitude"]],
-            popup=popup_txt,
-            tooltip=row.get("Address", "")
-        ).add_to(m)
+    popup = _text_col(data, "Name") + "<br>" + _text_col(data, "Address")
+    if "Category" in data.columns:
+        popup += "<br><b>" + _text_col(data, "Category") + "</b>"
+    tooltip = _text_col(data, "Address")
+    groups = data.groupby("Category", sort=False).indices if "Category" in data.columns else {"Places": slice(None)}
+
+    lat_all = data["Latitude"].to_numpy(dtype=float)
+    lon_all = data["Longitude"].to_numpy(dtype=float)
+    for label, idx in groups.items():
+        lat, lon = lat_all[idx], lon_all[idx]
+        if mode == "heatmap":
+            HeatMap(np.column_stack([lat, lon]).tolist(), name=str(label)).add_to(m)
+        elif mode == "cluster":
+            rows = list(zip(lat.tolist(), lon.tolist(), popup.iloc[idx].tolist(), tooltip.iloc[idx].tolist()))
+            FastMarkerCluster(rows, callback=_CLUSTER_MARKER, name=str(label)).add_to(m)
+        else:
+            features = [
+                {"type": "Feature", "geometry": {"type": "Point", "coordinates": [x, y]},
+                 "properties": {"popup": p, "tooltip": t}}
+                for x, y, p, t in zip(lon.tolist(), lat.tolist(), popup.iloc[idx].tolist(), tooltip.iloc[idx].tolist())
+            ]
+            folium.GeoJson({"type": "FeatureCollection", "features": features}, name=str(label),
+                           marker=folium.Marker(), on_each_feature=_BIND_POPUP).add_to(m)
 
+    folium.LayerControl(collapsed=False).add_to(m)
+    m.fit_bounds([[float(lat_all.min()), float(lon_all.min())], [float(lat_all.max()), float(lon_all.max())]])
     m.save(output_html)
-    print(f"🗺️ HTML map saved to: {output_html}")
+    print(f"🗺️ HTML map saved to: {output_html} ({mode}, {len(data)} places)")
 
 def normalize_for_filename(text):
     return (
@@ -238,7 +620,8 @@ def normalize_for_filename(text):
         .replace(",", "")
     )
 
-def main():
+def main(client=None):
+    """`client` defaults to the googlemaps client; pass FakePlacesClient() for an offline run."""
     print("🏠 Search Tool — Agencies & Associations")
 
     # Category selection
@@ -260,22 +643,16 @@ def main():
         print("❌ No coordinates provided. Exiting.")
         return
 
-    all_results = []
-
-    # For each point and selected category
-    for lat, lon in tqdm(points, desc="🔄 Searching points", unit="point"):
-        for c in choices:
-            meta = CATEGORIES[c]
-            cat_label = meta["label"]
-            results = search_places_generic(
-                lat=lat,
-                lon=lon,
-                radius=radius,
-                keywords=meta["keywords"],
-                place_type=meta["place_type"],
-                category_label=cat_label
-            )
-            all_results.extend(results)
+    # Every point × selected category, run concurrently within the API quota
+    cache = PlacesCache()
+    engine = PlacesEngine(client or gmaps, cache=cache)
+    t0 = time.perf_counter()
+    try:
+        all_results = asyncio.run(engine.run(points, choices, radius))
+    finally:
+        cache.close()
+    print(f"⏱️ {engine.calls} API calls in {time.perf_counter() - t0:.1f}s "
+          f"(cache hits: {cache.hits['nearby']} searches, {cache.hits['details']} details)")
 
     # Final DataFrame
     df = pd.DataFrame(all_results)
@@ -1,21 +1,50 @@
 import re
 from io import BytesIO
-from zipfile import ZipFile, ZIP_DEFLATED
 from PIL import Image, ImageDraw
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
+import gpkgwriter
+import kmlstream
+
 
 BASE_DIR = Path(r"")
 INPUT_XLSX = BASE_DIR / "PT_SUBS_FINAL_UPDATED.xlsx"     
 OUTPUT_KMZ = BASE_DIR / "PT_SUBS_FINAL_UPDATED_ALL.kmz"
 OUTPUT_GPKG = BASE_DIR / "PT_SUBS_FINAL_UPDATED_ALL.gpkg"
+OUTPUT_FGB = BASE_DIR / "PT_SUBS_FINAL_UPDATED_ALL.fgb"
+OUTPUT_PARQUET = BASE_DIR / "PT_SUBS_FINAL_UPDATED_ALL.parquet"
+VECTOR_FORMATS = ["gpkg"]   # "gpkg", "fgb" (FlatGeobuf) e/ou "parquet" (GeoParquet)
 OUTPUT_EXCEL_DEC = BASE_DIR / "PT_SUBS_FINAL_WITH_DECIMAL.xlsx"
 INVALID_CSV = BASE_DIR / "PT_SUBS_INVALID_COORDS.csv"
 KML_FILENAME = "doc.kml"
 ICON_FILENAME = "substation.png"
 NAME_COL_PRIORITY = ["Substation", "Name", "Substation Name", "substation_name"]
 
+KML_HEAD = """<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+  <Document>
+    <name>PT Substations (All)</name>
+    <Style id="substationStyle">
+      <IconStyle>
+        <scale>1.1</scale>
+        <Icon><href>{icon}</href></Icon>
+      </IconStyle>
+      <LabelStyle><scale>0.9</scale></LabelStyle>
+    </Style>
+    <Folder><name>Substations</name>
+"""
+PLACEMARK = """
+      <Placemark>
+        <name>{name}</name>
+        <styleUrl>#substationStyle</styleUrl>
+        <description><![CDATA[{desc}]]></description>
+        <Point><coordinates>{lon},{lat},0</coordinates></Point>
+      </Placemark>
+"""
+KML_TAIL = "    </Folder>\n  </Document>\n</kml>\n"
+
 
 def try_float(val):
     if pd.isna(val):
@@ -67,6 +96,53 @@ def parse_coord(value):
         return dms_to_decimal(m.group("deg"), m.group("min"), m.group("sec"), hem)
     return None
 
+DMS_CHARS = r"[°'’NSEWº″”′]"   # os mesmos sinais que try_float() recusa
+
+def parse_coord_column(values: pd.Series):
+    """
+    Versão por coluna de parse_coord(): (graus decimais, estado) com estado
+    "decimal", "dms", "missing" (célula vazia) ou "invalid". Números passam por
+    pd.to_numeric de uma vez; o resto por DMS_PATTERN via str.extract.
+    """
+    out = pd.Series(np.nan, index=values.index, dtype=float)
+    status = pd.Series("missing", index=values.index, dtype=object)
+    present = values.notna()
+
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        out[present] = values[present].astype(float)
+        status[present] = "decimal"
+        return out, status
+
+    s = values[present].map(str).str.strip()
+    plain = ~s.str.contains(DMS_CHARS, regex=True)
+    dec = pd.to_numeric(s[plain].str.replace(",", ".", regex=False), errors="coerce").astype(float)
+    # o que to_numeric não aceita mas float() sim (ex.: "1_000") — normalmente nada
+    odd = dec.isna()
+    if odd.any():
+        dec[odd] = s[plain][odd].map(try_float).astype(float)
+    dec = dec.dropna()
+    out[dec.index] = dec
+    status[dec.index] = "decimal"
+
+    rest = s.drop(dec.index)
+    status[rest.index] = "invalid"
+    m = rest.str.extract(DMS_PATTERN.pattern, flags=re.VERBOSE).dropna(subset=["deg", "min"])
+    if not m.empty:
+        sec = pd.to_numeric(m["sec"].str.replace(",", ".", regex=False), errors="coerce").fillna(0.0)
+        dms = m["deg"].astype(float) + m["min"].astype(float) / 60 + sec.to_numpy() / 3600
+        hem = m["hem1"].fillna(m["hem2"]).fillna("").str.upper()
+        out[m.index] = np.where(hem.isin(["S", "W"]), -dms, dms)
+        status[m.index] = "dms"
+
+    status[out.isna() & present] = "invalid"
+    return out, status
+
+def invalid_reason(lat_status: pd.Series, lon_status: pd.Series) -> pd.Series:
+    """Código do motivo de exclusão, ex.: "lat_missing", "lon_invalid" ou "lat_invalid;lon_missing"."""
+    lat = np.where(lat_status.isin(["missing", "invalid"]), "lat_" + lat_status, "")
+    lon = np.where(lon_status.isin(["missing", "invalid"]), "lon_" + lon_status, "")
+    return pd.Series(lat, index=lat_status.index).str.cat(pd.Series(lon, index=lon_status.index), sep=";").str.strip(";")
+
 def build_icon_png(size=96) -> BytesIO:
     img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
     draw = ImageDraw.Draw(img)
@@ -88,27 +164,56 @@ def build_icon_png(size=96) -> BytesIO:
 def esc(val):
     return str(val).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
 
-def write_gpkg(valid_df, name_col, lon_field="_lon_", lat_field="_lat_"):
+def esc_col(s: pd.Series) -> pd.Series:
+    """esc() aplicado a uma coluna inteira."""
+    return (s.map(str).str.replace("&", "&amp;", regex=False)
+            .str.replace("<", "&lt;", regex=False).str.replace(">", "&gt;", regex=False))
+
+def write_gpkg(valid_df, name_col, lon_field="_lon_", lat_field="_lat_", formats=None):
+    """
+    Grava os pontos válidos em cada formato de `formats` (default VECTOR_FORMATS).
+    As coordenadas são lidas uma vez como arrays; o GPKG é escrito diretamente
+    (gpkgwriter, em blocos de kmlstream.CHUNK_ROWS) e FlatGeobuf/GeoParquet saem
+    do mesmo GeoDataFrame montado com points_from_xy.
+    """
+    formats = VECTOR_FORMATS if formats is None else formats
+    attrs = valid_df.drop(columns=[c for c in ["_lat_", "_lon_"] if c in valid_df.columns]).reset_index(drop=True)
+    lon = valid_df[lon_field].to_numpy(dtype=float)
+    lat = valid_df[lat_field].to_numpy(dtype=float)
+
+    if "gpkg" in formats:
+        OUTPUT_GPKG.parent.mkdir(parents=True, exist_ok=True)
+        step = kmlstream.CHUNK_ROWS
+        with gpkgwriter.GpkgWriter(OUTPUT_GPKG) as gw:
+            for start in range(0, max(len(attrs), 1), step):
+                blobs, bounds = gpkgwriter.point_geometry(lon[start:start + step], lat[start:start + step])
+                chunk = attrs.iloc[start:start + step]
+                if start == 0:
+                    gw.write_layer("substations", chunk, blobs, bounds, "POINT")
+                else:
+                    gw.append_layer("substations", chunk, blobs, bounds)
+        print(f"GPKG gravado: {OUTPUT_GPKG}")
+
+    others = [f for f in formats if f != "gpkg"]
+    if not others:
+        return
     try:
         import geopandas as gpd
-        from shapely.geometry import Point
     except Exception:
-        print("Aviso: GeoPackage não gerado (geopandas/shapely não instalados).")
-        print("Instale com: pip install geopandas shapely pyproj fiona")
+        print(f"Aviso: {', '.join(others)} não gerado(s) (geopandas não instalado).")
+        print("Instale com: pip install geopandas shapely pyproj pyarrow")
         return
 
-    gdf = valid_df.copy()
-    
-    gdf["geometry"] = gdf.apply(lambda r: Point(float(r[lon_field]), float(r[lat_field])), axis=1)
-    gdf = gpd.GeoDataFrame(gdf, geometry="geometry", crs="EPSG:4326")
-
-    
-    drop_cols = [c for c in ["_lat_", "_lon_"] if c in gdf.columns]
-    gdf = gdf.drop(columns=drop_cols, errors="ignore")
-
-    OUTPUT_GPKG.parent.mkdir(parents=True, exist_ok=True)
-    gdf.to_file(OUTPUT_GPKG, layer="substations", driver="GPKG")
-    print(f"GPKG gravado: {OUTPUT_GPKG}")
+    gdf = gpd.GeoDataFrame(attrs, geometry=gpd.points_from_xy(lon, lat), crs="EPSG:4326")
+    if "fgb" in others:
+        gdf.to_file(OUTPUT_FGB, driver="FlatGeobuf")
+        print(f"FlatGeobuf gravado: {OUTPUT_FGB}")
+    if "parquet" in others:
+        # colunas object com tipos mistos (ex.: '38°42′' e 38.5) não passam no pyarrow → texto
+        obj = gdf.columns[(gdf.dtypes == object) & (gdf.columns != "geometry")]
+        gdf[obj] = gdf[obj].apply(lambda s: s.where(s.isna(), s.astype(str)))
+        gdf.to_parquet(OUTPUT_PARQUET)
+        print(f"GeoParquet gravado: {OUTPUT_PARQUET}")
 
 def main():
     if not INPUT_XLSX.exists():
@@ -126,8 +231,8 @@ def main():
     name_col = next((c for c in NAME_COL_PRIORITY if c in df.columns), None)
 
     
-    df["Latitude_decimal"]  = df[lat_col].apply(parse_coord)
-    df["Longitude_decimal"] = df[lon_col].apply(parse_coord)
+    df["Latitude_decimal"], lat_status = parse_coord_column(df[lat_col])
+    df["Longitude_decimal"], lon_status = parse_coord_column(df[lon_col])
 
     
     valid_mask = df["Latitude_decimal"].notna() & df["Longitude_decimal"].notna()
@@ -139,49 +244,20 @@ def main():
     
     cols_for_desc = list(df.columns)
 
-    kml_parts = []
-    kml_parts.append(f"""<?xml version="1.0" encoding="UTF-8"?>
-<kml xmlns="http://www.opengis.net/kml/2.2">
-  <Document>
-    <name>PT Substations (All)</name>
-    <Style id="substationStyle">
-      <IconStyle>
-        <scale>1.1</scale>
-        <Icon><href>{ICON_FILENAME}</href></Icon>
-      </IconStyle>
-      <LabelStyle><scale>0.9</scale></LabelStyle>
-    </Style>
-    <Folder><name>Substations</name>
-""")
-
-    for idx, row in valid.iterrows():
-        lat = row["Latitude_decimal"]
-        lon = row["Longitude_decimal"]
-        name = str(row[name_col]) if name_col else f"Site {idx+1}"
-
-        html_rows = ["<table border='1' cellpadding='3' cellspacing='0'>"]
-        for col in cols_for_desc:
-            val = row.get(col, "")
-            html_rows.append(f"<tr><th align='left'>{esc(col)}</th><td>{esc(val)}</td></tr>")
-        html_rows.append("</table>")
-        desc_html = "".join(html_rows)
-
-        kml_parts.append(f"""
-      <Placemark>
-        <name>{esc(name)}</name>
-        <styleUrl>#substationStyle</styleUrl>
-        <description><![CDATA[{desc_html}]]></description>
-        <Point><coordinates>{lon},{lat},0</coordinates></Point>
-      </Placemark>
-""")
-
-    kml_parts.append("    </Folder>\n  </Document>\n</kml>\n")
-    kml_bytes = "".join(kml_parts).encode("utf-8")
-
     OUTPUT_KMZ.parent.mkdir(parents=True, exist_ok=True)
-    with ZipFile(OUTPUT_KMZ, "w", ZIP_DEFLATED) as zf:
-        zf.writestr(KML_FILENAME, kml_bytes)
-        zf.writestr(ICON_FILENAME, icon_bytes.read())
+    with kmlstream.KmzStream(OUTPUT_KMZ, kml_name=KML_FILENAME, sep="") as kz:
+        kz.write(KML_HEAD.format(icon=ICON_FILENAME))
+        for c in kmlstream.iter_chunks(valid):
+            rows = [kmlstream.tr(esc(col), esc_col(c[col])) for col in cols_for_desc]
+            names = esc_col(c[name_col]) if name_col else [f"Site {i+1}" for i in c.index]
+            kmlstream.write_placemarks(
+                kz, PLACEMARK,
+                name=names,
+                desc=kmlstream.table(rows),
+                lon=c["Longitude_decimal"], lat=c["Latitude_decimal"],
+            )
+        kz.write(KML_TAIL)
+        kz.add_bytes(ICON_FILENAME, icon_bytes.read())
     print(f"KMZ gravado: {OUTPUT_KMZ}")
 
     
@@ -201,10 +277,13 @@ def main():
             rep_cols.append(name_col)
         rep_cols.extend([lat_col, lon_col, "Latitude_decimal", "Longitude_decimal"])
         rep_cols = [c for c in rep_cols if c in df.columns or c in ["Latitude_decimal","Longitude_decimal"]]
-        invalid[rep_cols].to_csv(INVALID_CSV, index=False, encoding="utf-8-sig")
+        report = invalid[rep_cols].copy()
+        report["Reason"] = invalid_reason(lat_status[~valid_mask], lon_status[~valid_mask])
+        report.to_csv(INVALID_CSV, index=False, encoding="utf-8-sig")
         print(f"CSV inválidos: {INVALID_CSV}")
 
     print(f"Linhas totais: {len(df)} | Incluídas: {len(valid)} | Excluídas: {len(invalid)}")
+    print(f"Formatos lidos — Lat: {lat_status.value_counts().to_dict()} | Lon: {lon_status.value_counts().to_dict()}")
 
 if __name__ == "__main__":
     main()
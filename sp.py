@@ -1,17 +1,28 @@
+import argparse
 import html
+import io
+import json
+import os
 import re
 import unicodedata
 import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from functools import lru_cache
 from pathlib import Path
 from typing import Optional, Tuple
 
+import numpy as np
 import pandas as pd
 from pyproj import Transformer
 
+import gpkgwriter
+import kmlstream
+import xlsxcache
+
 
 ICON_ON = "ON.png"
 ICON_OFF = "of.png"
+CODE_VERSION = xlsxcache.code_version(__file__)
 
 
 DATASETS = [
@@ -140,22 +151,70 @@ def inside(lat, lon, bbox, pad=0.25):
     lo_min, la_min, lo_max, la_max = bbox
     return (lo_min - pad) <= lon <= (lo_max + pad) and (la_min - pad) <= lat <= (la_max + pad)
 
-def convert_by_region(easting, northing, region):
+def inside_mask(lat, lon, bbox, pad=0.25):
+    """Versão vetorizada de inside() para arrays NumPy."""
+    lo_min, la_min, lo_max, la_max = bbox
+    return ((lon >= lo_min - pad) & (lon <= lo_max + pad) &
+            (lat >= la_min - pad) & (lat <= la_max + pad))
+
+COUNTRY_BBOX = (-19.5, 27.0, 5.5, 44.8)  # Península + Baleares + Canárias
+
+def _region_candidates(region):
     r = _norm(region)
     rule = REGION_RULES.get(r)
     epsgs = (rule["epsg"] if rule else []) + GENERIC_EPSG
     bbox = rule["bbox"] if rule else None
+    return epsgs, bbox
+
+def convert_by_region(easting, northing, region):
+    epsgs, bbox = _region_candidates(region)
     for epsg in epsgs:
         tr = get_tr(epsg)
         lon, lat = tr.transform(float(easting), float(northing))
         if bbox and inside(lat, lon, bbox):
             return lat, lon, epsg, "by region"
-        if not bbox and (-19.5 <= lon <= 5.5) and (27.0 <= lat <= 44.8):
+        if not bbox and inside(lat, lon, COUNTRY_BBOX, pad=0):
             return lat, lon, epsg, "by country"
     
     lon, lat = get_tr("25830").transform(float(easting), float(northing))
     return lat, lon, "25830", "fallback"
 
+def convert_by_region_batch(easting, northing, region):
+    """
+    Igual a convert_by_region, mas para um grupo de linhas da mesma região:
+    cada EPSG candidato transforma o array inteiro e só as linhas ainda por
+    resolver passam ao candidato seguinte.
+    Devolve (lat, lon, epsg, method) como arrays.
+    """
+    x = np.asarray(easting, dtype=float)
+    y = np.asarray(northing, dtype=float)
+    n = len(x)
+    lat = np.full(n, np.nan)
+    lon = np.full(n, np.nan)
+    chosen = np.full(n, "", dtype=object)
+    method = np.full(n, "", dtype=object)
+
+    epsgs, bbox = _region_candidates(region)
+    box, pad, how = (bbox, 0.25, "by region") if bbox else (COUNTRY_BBOX, 0, "by country")
+
+    todo = np.arange(n)
+    for epsg in dict.fromkeys(epsgs):  # repetidos não resolvem nada de novo
+        if not todo.size:
+            break
+        lo, la = get_tr(epsg).transform(x[todo], y[todo])
+        lo, la = np.asarray(lo, dtype=float), np.asarray(la, dtype=float)
+        ok = inside_mask(la, lo, box, pad)
+        hit = todo[ok]
+        lat[hit], lon[hit] = la[ok], lo[ok]
+        chosen[hit], method[hit] = epsg, how
+        todo = todo[~ok]
+
+    if todo.size:
+        lo, la = get_tr("25830").transform(x[todo], y[todo])
+        lat[todo], lon[todo] = la, lo
+        chosen[todo], method[todo] = "25830", "fallback"
+    return lat, lon, chosen, method
+
 
 def _convert_coords(df: pd.DataFrame, flags: dict) -> Tuple[pd.Series, pd.Series, str]:
     """
@@ -191,31 +250,47 @@ def _convert_coords(df: pd.DataFrame, flags: dict) -> Tuple[pd.Series, pd.Series
         df['Chosen EPSG'] = ''
     df['Method'] = ''
 
-    lats, lons, epsgs, methods = [], [], [], []
+    idx = easting[valid].index
+    xs = easting[valid].to_numpy(dtype=float)
+    ys = northing[valid].to_numpy(dtype=float)
 
     if flags.get("force_epsg"):
         epsg = str(flags["force_epsg"])
-        tr = get_tr(epsg)
-        for x, y in zip(easting[valid], northing[valid]):
-            lo, la = tr.transform(float(x), float(y))
-            lats.append(la); lons.append(lo); epsgs.append(epsg); methods.append("forced epsg")
+        lons, lats = get_tr(epsg).transform(xs, ys)
+        epsgs = [epsg] * len(xs)
+        methods = ["forced epsg"] * len(xs)
     else:
-        reg_series = df.loc[valid, 'Region'] if 'Region' in df.columns else pd.Series(['']*int(valid.sum()), index=easting[valid].index)
-        for x, y, r in zip(easting[valid], northing[valid], reg_series):
-            la, lo, ep, how = convert_by_region(x, y, r)
-            lats.append(la); lons.append(lo); epsgs.append(ep); methods.append(how)
+        reg_series = df.loc[valid, 'Region'] if 'Region' in df.columns else pd.Series(['']*int(valid.sum()), index=idx)
+        lats, lons = np.full(len(xs), np.nan), np.full(len(xs), np.nan)
+        epsgs, methods = np.full(len(xs), "", dtype=object), np.full(len(xs), "", dtype=object)
+        # um lote por região normalizada (mesmas regras → mesmos candidatos EPSG)
+        keys = reg_series.map(_norm)
+        for _, pos in keys.groupby(keys.values, sort=False).indices.items():
+            la, lo, ep, how = convert_by_region_batch(xs[pos], ys[pos], reg_series.iloc[pos[0]])
+            lats[pos], lons[pos], epsgs[pos], methods[pos] = la, lo, ep, how
 
     lat = pd.Series(index=df.index, dtype=float)
     lon = pd.Series(index=df.index, dtype=float)
-    lat.loc[easting[valid].index] = lats
-    lon.loc[northing[valid].index] = lons
-    df.loc[easting[valid].index, 'Chosen EPSG'] = epsgs
-    df.loc[easting[valid].index, 'Method'] = methods
+    lat.loc[idx] = lats
+    lon.loc[idx] = lons
+    df.loc[idx, 'Chosen EPSG'] = list(epsgs)
+    df.loc[idx, 'Method'] = list(methods)
     return lat, lon, "utm->wgs84"
 
 
-def load_and_standardize(source: str, xlsx_path: Path, flags: dict):
-    """Lê o Excel e devolve dataframe normalizado (inclui conversão de coordenadas)."""
+def load_and_standardize(source: str, xlsx_path: Path, flags: dict, use_cache: bool = True):
+    """
+    Lê o Excel e devolve dataframe normalizado (inclui conversão de coordenadas).
+    Com use_cache, o resultado fica em cache (hash do ficheiro + flags + versão do código)
+    e um hit evita tanto o read_excel como a conversão de coordenadas.
+    """
+    key = None
+    if use_cache:
+        key = xlsxcache.cache_key(xlsx_path, CODE_VERSION, source=source, flags=flags)
+        cached = xlsxcache.load(key)
+        if cached is not None:
+            return cached
+
     df = pd.read_excel(xlsx_path)
 
     
@@ -272,174 +347,345 @@ def load_and_standardize(source: str, xlsx_path: Path, flags: dict):
     else:
         out["Chosen EPSG"] = ""
 
+    if key:
+        xlsxcache.store(key, out)
     return out
 
 
-def build_kmz(df: pd.DataFrame, kmz_path: Path, name: str, include_nudo: bool = True):
-    kml = [
-        '<?xml version="1.0" encoding="UTF-8"?>',
-        '<kml xmlns="http://www.opengis.net/kml/2.2">', "<Document>",
-        f"<name>{name}</name>",
-        '<Style id="onStyle"><IconStyle><scale>1.0</scale><Icon><href>ON.png</href></Icon></IconStyle></Style>',
-        '<Style id="offStyle"><IconStyle><scale>1.0</scale><Icon><href>of.png</href></Icon></IconStyle></Style>',
-    ]
-
-    def row_desc(row):
-        rows = [
-            ("Substation", _safe(row.get("Substation"))),
-            ("Region", _safe(row.get("Region"))),
-            ("Tension (kV)", _safe(row.get("Tension (kV)"))),
-            ("Available Capacity (MW)", _safe(row.get("Available Capacity (MW)"))),
-        ]
-        if include_nudo and "Nudo Afección RdT" in row.index:
-            rows.append(("Nudo Afección RdT", _safe(row.get("Nudo Afección RdT"))))
-        rows += [
-            ("Availability", "Y" if str(row.get("Availability")).upper() == "Y" else "N"),
-            ("Grid Owner", _safe(row.get("Grid Owner"))),
-            ("Grid Type", _safe(row.get("Grid Type"))),
-            ("Lat, Lon", f"{float(row['Latitude']):.6f}, {float(row['Longitude']):.6f}"),
-        ]
-        table = "<table border='1' cellpadding='3' cellspacing='0'>" + "".join(
-            f"<tr><th align='left'>{k}</th><td>{v}</td></tr>" for k, v in rows
-        ) + "</table>"
-        return f"<![CDATA[{table}]]>"
+KML_HEADER = [
+    '<?xml version="1.0" encoding="UTF-8"?>',
+    '<kml xmlns="http://www.opengis.net/kml/2.2">', "<Document>",
+]
+KML_STYLES = [
+    '<Style id="onStyle"><IconStyle><scale>1.0</scale><Icon><href>ON.png</href></Icon></IconStyle></Style>',
+    '<Style id="offStyle"><IconStyle><scale>1.0</scale><Icon><href>of.png</href></Icon></IconStyle></Style>',
+]
+PLACEMARK = (
+    "<Placemark><name>{name}</name><styleUrl>{style}</styleUrl>"
+    "<description>{desc}</description>"
+    "<Point><coordinates>{lon:.6f},{lat:.6f},0</coordinates></Point></Placemark>"
+)
 
-   
-    for region, g in df.groupby("Region"):
-        kml.append(f"<Folder><name>{html.escape(str(region))}</name>")
-        for _, row in g.iterrows():
-            lat, lon = float(row["Latitude"]), float(row["Longitude"])
-            style = "#onStyle" if str(row.get("Availability","")).upper() == "Y" else "#offStyle"
-            name_pm = str(row.get("Substation",""))
-            kml.append(
-                f"<Placemark><name>{html.escape(name_pm)}</name><styleUrl>{style}</styleUrl>"
-                f"<description>{row_desc(row)}</description>"
-                f"<Point><coordinates>{lon:.6f},{lat:.6f},0</coordinates></Point></Placemark>"
-            )
-        kml.append("</Folder>")
-    kml.append("</Document></kml>")
-    with zipfile.ZipFile(kmz_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-        zf.writestr("doc.kml", "\n".join(kml))
-        zf.write(ICON_ON, "ON.png")
-        zf.write(ICON_OFF, "of.png")
 
-def build_kmz_all(df_all: pd.DataFrame, kmz_path: Path):
-  
-    kml = [
-        '<?xml version="1.0" encoding="UTF-8"?>',
-        '<kml xmlns="http://www.opengis.net/kml/2.2">', "<Document>",
-        "<name>all_substations</name>",
-        '<Style id="onStyle"><IconStyle><scale>1.0</scale><Icon><href>ON.png</href></Icon></IconStyle></Style>',
-        '<Style id="offStyle"><IconStyle><scale>1.0</scale><Icon><href>of.png</href></Icon></IconStyle></Style>',
-    ]
-
-    def row_desc(row):
-        rows = [
-            ("Source", _safe(row.get("Source"))),
-            ("Substation", _safe(row.get("Substation"))),
-            ("Region", _safe(row.get("Region"))),
-            ("Tension (kV)", _safe(row.get("Tension (kV)"))),
-            ("Available Capacity (MW)", _safe(row.get("Available Capacity (MW)"))),
+def _cells(g: pd.DataFrame, col: str) -> pd.Series:
+    return kmlstream.safe_col(g[col]) if col in g.columns else pd.Series([""] * len(g), index=g.index)
+
+
+def _write_points(kz: kmlstream.KmzStream, g: pd.DataFrame, include_source: bool, nudo: Optional[str]):
+    """
+    Escreve os placemarks de `g` por blocos de linhas, com a tabela de descrição
+    montada por coluna. nudo: "always" (se a coluna existir), "nonempty" (só
+    quando a célula tem texto) ou None.
+    """
+    for c in kmlstream.iter_chunks(g):
+        lat = c["Latitude"].astype(float)
+        lon = c["Longitude"].astype(float)
+        avail_y = c["Availability"].map(str).str.upper() == "Y" if "Availability" in c.columns \
+            else pd.Series(False, index=c.index)
+
+        rows = [kmlstream.tr("Source", _cells(c, "Source"))] if include_source else []
+        rows += [
+            kmlstream.tr("Substation", _cells(c, "Substation")),
+            kmlstream.tr("Region", _cells(c, "Region")),
+            kmlstream.tr("Tension (kV)", _cells(c, "Tension (kV)")),
+            kmlstream.tr("Available Capacity (MW)", _cells(c, "Available Capacity (MW)")),
         ]
-        if "Nudo Afección RdT" in row.index and str(row.get("Nudo Afección RdT","")).strip():
-            rows.append(("Nudo Afección RdT", _safe(row.get("Nudo Afección RdT"))))
+        if nudo and "Nudo Afección RdT" in c.columns:
+            row_nudo = kmlstream.tr("Nudo Afección RdT", _cells(c, "Nudo Afección RdT"))
+            if nudo == "nonempty":
+                row_nudo = row_nudo.where(c["Nudo Afección RdT"].map(str).str.strip() != "", "")
+            rows.append(row_nudo)
         rows += [
-            ("Availability", "Y" if str(row.get("Availability","")).upper() == "Y" else "N"),
-            ("Grid Owner", _safe(row.get("Grid Owner"))),
-            ("Grid Type", _safe(row.get("Grid Type"))),
-            ("Lat, Lon", f"{float(row['Latitude']):.6f}, {float(row['Longitude']):.6f}"),
+            kmlstream.tr("Availability", kmlstream.style_col(avail_y, "Y", "N")),
+            kmlstream.tr("Grid Owner", _cells(c, "Grid Owner")),
+            kmlstream.tr("Grid Type", _cells(c, "Grid Type")),
+            kmlstream.tr("Lat, Lon", kmlstream.latlon_col(lat, lon)),
         ]
-        table = "<table border='1' cellpadding='3' cellspacing='0'>" + "".join(
-            f"<tr><th align='left'>{k}</th><td>{v}</td></tr>" for k, v in rows
-        ) + "</table>"
-        return f"<![CDATA[{table}]]>"
 
-  
-    for source, gsrc in df_all.groupby("Source"):
-        kml.append(f"<Folder><name>{html.escape(str(source))}</name>")
-        for region, g in gsrc.groupby("Region"):
-            kml.append(f"<Folder><name>{html.escape(str(region))}</name>")
-            for _, row in g.iterrows():
-                lat, lon = float(row["Latitude"]), float(row["Longitude"])
-                style = "#onStyle" if str(row.get("Availability","")).upper() == "Y" else "#offStyle"
-                name_pm = str(row.get("Substation",""))
-                kml.append(
-                    f"<Placemark><name>{html.escape(name_pm)}</name><styleUrl>{style}</styleUrl>"
-                    f"<description>{row_desc(row)}</description>"
-                    f"<Point><coordinates>{lon:.6f},{lat:.6f},0</coordinates></Point></Placemark>"
-                )
-            kml.append("</Folder>")
-        kml.append("</Folder>")
-    kml.append("</Document></kml>")
-    with zipfile.ZipFile(kmz_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-        zf.writestr("doc.kml", "\n".join(kml))
-        zf.write(ICON_ON, "ON.png")
-        zf.write(ICON_OFF, "of.png")
+        names = c["Substation"].map(str).map(html.escape) if "Substation" in c.columns else [""] * len(c)
+        kmlstream.write_placemarks(
+            kz, PLACEMARK,
+            name=names,
+            style=kmlstream.style_col(avail_y, "#onStyle", "#offStyle"),
+            desc=kmlstream.cdata(kmlstream.table(rows)),
+            lon=lon, lat=lat,
+        )
+
+
+def build_kmz(df: pd.DataFrame, kmz_path: Path, name: str, include_nudo: bool = True):
+    with kmlstream.KmzStream(kmz_path) as kz:
+        for line in KML_HEADER + [f"<name>{name}</name>"] + KML_STYLES:
+            kz.write(line)
+        for region, g in df.groupby("Region"):
+            kz.write(f"<Folder><name>{html.escape(str(region))}</name>")
+            _write_points(kz, g, include_source=False, nudo="always" if include_nudo else None)
+            kz.write("</Folder>")
+        kz.write("</Document></kml>")
+        kz.add_file(ICON_ON, "ON.png")
+        kz.add_file(ICON_OFF, "of.png")
+
+def _write_source_folder(kz: kmlstream.KmzStream, source, gsrc: pd.DataFrame):
+    kz.write(f"<Folder><name>{html.escape(str(source))}</name>")
+    for region, g in gsrc.groupby("Region"):
+        kz.write(f"<Folder><name>{html.escape(str(region))}</name>")
+        _write_points(kz, g, include_source=True, nudo="nonempty")
+        kz.write("</Folder>")
+    kz.write("</Folder>")
+
+def build_kmz_all(df_all: pd.DataFrame, kmz_path: Path):
+    with kmlstream.KmzStream(kmz_path) as kz:
+        for line in KML_HEADER + ["<name>all_substations</name>"] + KML_STYLES:
+            kz.write(line)
+        for source, gsrc in df_all.groupby("Source"):
+            _write_source_folder(kz, source, gsrc)
+        kz.write("</Document></kml>")
+        kz.add_file(ICON_ON, "ON.png")
+        kz.add_file(ICON_OFF, "of.png")
+
+def _iter_source_blocks(lines):
+    """(nome, linhas) de cada <Folder> de topo (um por Source) de um doc.kml do all_substations."""
+    depth, name, block = 0, None, []
+    for raw in lines:
+        line = raw.rstrip("\n")
+        if line.startswith("<Folder>"):
+            depth += 1
+            if depth == 1:
+                m = re.match(r"<Folder><name>(.*?)</name>", line)
+                name, block = (m.group(1) if m else ""), []
+        if depth >= 1:
+            block.append(line)
+        if line == "</Folder>":
+            depth -= 1
+            if depth == 0:
+                yield name, block
+
+def patch_kmz_all(df_all: pd.DataFrame, kmz_path: Path, stale: set):
+    """
+    Reescreve o all_substations.kmz copiando tal e qual as pastas das fontes que
+    não mudaram (lidas em streaming do KMZ anterior) e gerando só as de `stale`.
+    As pastas estão pela mesma ordem (groupby("Source")) nos dois ficheiros.
+    """
+    tmp = kmz_path.with_name(kmz_path.stem + ".tmp.kmz")
+    with zipfile.ZipFile(kmz_path) as old, old.open("doc.kml") as f, kmlstream.KmzStream(tmp) as kz:
+        blocks = _iter_source_blocks(io.TextIOWrapper(f, encoding="utf-8"))
+        for line in KML_HEADER + ["<name>all_substations</name>"] + KML_STYLES:
+            kz.write(line)
+        for source, gsrc in df_all.groupby("Source"):
+            reused = False
+            if source not in stale:
+                name = html.escape(str(source))
+                for old_name, lines in blocks:
+                    if old_name == name:
+                        for line in lines:
+                            kz.write(line)
+                        reused = True
+                        break
+            if not reused:
+                _write_source_folder(kz, source, gsrc)
+        kz.write("</Document></kml>")
+        kz.add_file(ICON_ON, "ON.png")
+        kz.add_file(ICON_OFF, "of.png")
+    os.replace(tmp, kmz_path)
+
+
+def gpkg_layer_name(source) -> str:
+    return re.sub(r"[^A-Za-z0-9_]+", "_", str(source)).lower().strip("_")
 
 
 def build_gpkg(df_all: pd.DataFrame, gpkg_path: Path):
-    """Exporta um GeoPackage (EPSG:4326) com camada combinada e camadas por Source."""
+    """
+    Exporta um GeoPackage (EPSG:4326) com camada combinada e camadas por Source.
+    As geometrias são construídas uma vez para o dataframe combinado e todas as
+    camadas vão na mesma ligação/transação; os índices espaciais ficam para o fim.
+    """
+    blobs, bounds = gpkgwriter.point_geometry(df_all["Longitude"], df_all["Latitude"])
+    with gpkgwriter.GpkgWriter(gpkg_path) as gw:
+        gw.write_layer("all_substations", df_all, blobs, bounds, "POINT")
+        for source, pos in df_all.groupby("Source").indices.items():
+            gw.write_layer(gpkg_layer_name(source), df_all.iloc[pos], blobs[pos], bounds[pos], "POINT")
+
+    for layer, secs in gw.timings.items():
+        print(f"   • {layer}: {secs:.2f}s")
+    print(f"✅ GeoPackage gerado: {gpkg_path}")
+
+
+def patch_gpkg(df_all: pd.DataFrame, gpkg_path: Path, stale: set, removed: set):
+    """Atualiza o GeoPackage existente: camada combinada + camadas das fontes em `stale`; remove as de `removed`."""
+    blobs, bounds = gpkgwriter.point_geometry(df_all["Longitude"], df_all["Latitude"])
+    with gpkgwriter.GpkgWriter(gpkg_path, overwrite=False) as gw:
+        for source in removed:
+            gw.delete_layer(gpkg_layer_name(source))
+        gw.write_layer("all_substations", df_all, blobs, bounds, "POINT")
+        for source, pos in df_all.groupby("Source").indices.items():
+            if source in stale:
+                gw.write_layer(gpkg_layer_name(source), df_all.iloc[pos], blobs[pos], bounds[pos], "POINT")
+
+    for layer, secs in gw.timings.items():
+        print(f"   • {layer}: {secs:.2f}s")
+    print(f"✅ GeoPackage atualizado: {gpkg_path}")
+
+
+MANIFEST = "all_substations.manifest.json"
+
+
+def _source_outputs(base: Path, source: str, fname: str):
+    kmz_name = f"{Path(fname).stem}.kmz" if source != "REE" else "REE.kmz"
+    return base / kmz_name, base / f"{Path(fname).stem}_standardized.xlsx"
+
+def _fingerprint(path: Path):
+    """Impressão barata de um ficheiro de saída (tamanho + mtime); None se não existir."""
     try:
-        import geopandas as gpd
-        from shapely.geometry import Point
-    except Exception as e:
-        print(f"⚠️ GeoPackage não gerado (instale geopandas e shapely): {e}")
-        return
-
-    def as_gdf(df: pd.DataFrame):
-        return gpd.GeoDataFrame(
-            df.copy(),
-            geometry=gpd.points_from_xy(df["Longitude"], df["Latitude"]),
-            crs="EPSG:4326",
-        )
+        st = path.stat()
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+def _source_state(base: Path, source: str, fname: str, flags: dict) -> dict:
+    kmz, xlsx = _source_outputs(base, source, fname)
+    return {
+        "input": xlsxcache.file_sha256(base / fname),
+        "flags": json.dumps(flags, sort_keys=True, default=str),
+        "code": CODE_VERSION,
+        "outputs": {"kmz": _fingerprint(kmz), "xlsx": _fingerprint(xlsx)},
+    }
+
+def _is_fresh(state: dict, old: Optional[dict]) -> bool:
+    """A fonte não mudou: mesmo input/flags/código e as saídas ainda são as que foram registadas."""
+    if not old:
+        return False
+    return all(state[k] == old.get(k) for k in ("input", "flags", "code", "outputs")) \
+        and None not in state["outputs"].values()
+
+def load_manifest(base: Path) -> dict:
+    try:
+        with open(base / MANIFEST, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-    gdf_all = as_gdf(df_all)
-    gdf_all.to_file(gpkg_path, layer="all_substations", driver="GPKG")
+def save_manifest(base: Path, manifest: dict):
+    tmp = base / (MANIFEST + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, ensure_ascii=False)
+    os.replace(tmp, base / MANIFEST)
 
-    import re as _re
-    for source, g in df_all.groupby("Source"):
-        layer = _re.sub(r"[^A-Za-z0-9_]+", "_", str(source)).lower().strip("_")
-        as_gdf(g).to_file(gpkg_path, layer=layer, driver="GPKG")
 
-    print(f"✅ GeoPackage gerado: {gpkg_path}")
+def process_dataset(base: Path, source: str, fname: str, flags: dict, use_cache: bool = True):
+    """
+    Processa uma entrada de DATASETS: lê, normaliza, gera o KMZ da fonte e o
+    _standardized.xlsx. Devolve (df_std ou None, mensagens) — os erros de leitura
+    ficam isolados nesta fonte. Corre tanto em série como num worker do pool.
+    """
+    path = base / fname
+    if not path.exists():
+        return None, [f"• {source}: ficheiro não encontrado ({fname}) — a ignorar."]
+    msgs = [f"🔄 {source}: a processar {fname} ..."]
+    try:
+        df_std = load_and_standardize(source, path, flags, use_cache=use_cache)
+    except Exception as e:
+        msgs.append(f"   ❌ Erro em {source}: {e}")
+        return None, msgs
 
+   
+    kmz_path, xlsx_path = _source_outputs(base, source, fname)
+    include_nudo = not flags.get("tso")
+    build_kmz(df_std, kmz_path, name=kmz_path.stem, include_nudo=include_nudo)
+    msgs.append(f"   ✅ KMZ: {kmz_path.name}  |  {len(df_std)} pontos")
 
-def run():
+    
+    df_std.to_excel(xlsx_path, index=False)
+    return df_std, msgs
+
+
+def run(jobs: int = 1, use_cache: bool = True, incremental: bool = False):
+    """
+    Processa DATASETS e gera all_substations.*. Em modo incremental, o manifesto
+    (all_substations.manifest.json) diz que fontes mudaram: só essas são
+    reprocessadas e, nos ficheiros combinados, só a pasta (KMZ) / camada (GPKG)
+    dessas fontes é substituída. O Excel combinado é sempre reescrito se algo mudou.
+    """
     base = Path(".")
     if not (base / ICON_ON).exists() or not (base / ICON_OFF).exists():
         raise SystemExit("❌ Ícones ON.png e/of.png não encontrados na pasta de trabalho.")
 
-    frames = []
-    for source, fname, flags in DATASETS:
-        path = base / fname
-        if not path.exists():
-            print(f"• {source}: ficheiro não encontrado ({fname}) — a ignorar.")
-            continue
-        print(f"🔄 {source}: a processar {fname} ...")
-        try:
-            df_std = load_and_standardize(source, path, flags)
-        except Exception as e:
-            print(f"   ❌ Erro em {source}: {e}")
+    manifest = load_manifest(base) if incremental else {}
+    old_sources = manifest.get("sources", {})
+
+    # resultados indexados pela posição em DATASETS → ordem final igual à do modo série
+    results = [None] * len(DATASETS)
+    todo = []
+    for i, (source, fname, flags) in enumerate(DATASETS):
+        if incremental and (base / fname).exists() and \
+                _is_fresh(_source_state(base, source, fname, flags), old_sources.get(source)):
+            results[i] = load_and_standardize(source, base / fname, flags, use_cache=use_cache)
+            print(f"• {source}: sem alterações — a reutilizar {_source_outputs(base, source, fname)[0].name}")
             continue
-        frames.append(df_std)
-
-       
-        kmz_name = f"{Path(fname).stem}.kmz" if source != "REE" else "REE.kmz"
-        include_nudo = not flags.get("tso")
-        build_kmz(df_std, base / kmz_name, name=Path(kmz_name).stem, include_nudo=include_nudo)
-        print(f"   ✅ KMZ: {kmz_name}  |  {len(df_std)} pontos")
-
-        
-        df_std.to_excel(base / f"{Path(fname).stem}_standardized.xlsx", index=False)
+        todo.append(i)
+
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {
+                pool.submit(process_dataset, base, *DATASETS[i], use_cache): i
+                for i in todo
+            }
+            for fut in as_completed(futures):
+                df_std, msgs = fut.result()
+                print("\n".join(msgs))
+                results[futures[fut]] = df_std
+    else:
+        for i in todo:
+            df_std, msgs = process_dataset(base, *DATASETS[i], use_cache)
+            print("\n".join(msgs))
+            results[i] = df_std
 
+    frames = [df for df in results if df is not None]
     if not frames:
         raise SystemExit("❌ Nenhum dataset encontrado na pasta.")
 
     df_all = pd.concat(frames, ignore_index=True)
-    df_all.to_excel(base / "all_substations.xlsx", index=False)
-    build_kmz_all(df_all, base / "all_substations.kmz")
-    build_gpkg(df_all, base / "all_substations.gpkg")
+    present = {DATASETS[i][0] for i, df in enumerate(results) if df is not None}
+    stale = {DATASETS[i][0] for i in todo if results[i] is not None}
+    removed = set(old_sources) - present
+    changed = bool(stale or removed)
+
+    merged = {"xlsx": base / "all_substations.xlsx",
+              "kmz": base / "all_substations.kmz",
+              "gpkg": base / "all_substations.gpkg"}
+    old_merged = manifest.get("merged", {})
+    # saída combinada em falta ou alterada por fora → gera-se de raiz
+    rebuild = {k: not incremental or _fingerprint(p) is None or _fingerprint(p) != old_merged.get(k)
+               for k, p in merged.items()}
+
+    if incremental:
+        print(f"\n🧩 Incremental: {len(stale)} fonte(s) reprocessada(s), {len(removed)} removida(s).")
+    if changed or rebuild["xlsx"]:
+        df_all.to_excel(merged["xlsx"], index=False)
+    if rebuild["kmz"]:
+        build_kmz_all(df_all, merged["kmz"])
+    elif changed:
+        patch_kmz_all(df_all, merged["kmz"], stale)
+    if rebuild["gpkg"]:
+        build_gpkg(df_all, merged["gpkg"])
+    elif changed:
+        patch_gpkg(df_all, merged["gpkg"], stale, removed)
+
+    save_manifest(base, {
+        "code": CODE_VERSION,
+        "sources": {source: _source_state(base, source, fname, flags)
+                    for source, fname, flags in DATASETS if source in present},
+        "merged": {k: _fingerprint(p) for k, p in merged.items()},
+    })
     print(f"\n🎉 Concluído! all_substations.kmz e all_substations.gpkg com {len(df_all)} pontos.")
 
+
+def main():
+    ap = argparse.ArgumentParser(description="Normaliza os datasets de subestações e gera KMZ/Excel/GeoPackage.")
+    ap.add_argument("--jobs", type=int, default=1, help="Nº de processos para tratar as fontes em paralelo (default: 1 = série)")
+    ap.add_argument("--no-cache", action="store_true", help="Ignora a cache de Excel já processados e relê tudo")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Só reprocessa as fontes alteradas (manifesto) e atualiza os ficheiros combinados")
+    args = ap.parse_args()
+    run(jobs=max(1, args.jobs), use_cache=not args.no_cache, incremental=args.incremental)
+
 if __name__ == "__main__":
-    run()
+    main()
@@ -2,10 +2,15 @@ import argparse
 import html
 import re
 import unicodedata
-import zipfile
 from pathlib import Path
 import pandas as pd
 
+import kmlstream
+import xlsxcache
+
+
+CODE_VERSION = xlsxcache.code_version(__file__)
+
 
 def _norm(s: str) -> str:
     s = str(s).strip().lower()
@@ -31,8 +36,15 @@ def _find_col(possible, df: pd.DataFrame):
     return None
 
 
-def load_storage(input_xlsx: Path) -> pd.DataFrame:
-    """Carrega o Excel e devolve dataframe padronizado com colunas esperadas."""
+def load_storage(input_xlsx: Path, use_cache: bool = True) -> pd.DataFrame:
+    """Carrega o Excel e devolve dataframe padronizado com colunas esperadas (com cache em disco)."""
+    key = None
+    if use_cache:
+        key = xlsxcache.cache_key(input_xlsx, CODE_VERSION)
+        cached = xlsxcache.load(key)
+        if cached is not None:
+            return cached
+
     df = pd.read_excel(input_xlsx)
 
     sub  = _find_col(["Substation","Subestacao","Subestación","Name","Nombre"], df)
@@ -69,55 +81,56 @@ def load_storage(input_xlsx: Path) -> pd.DataFrame:
     })
     
     out = out.dropna(subset=["Latitude","Longitude"]).reset_index(drop=True)
+    if key:
+        xlsxcache.store(key, out)
     return out
 
 
+PLACEMARK = (
+    "<Placemark><name>{name}</name><styleUrl>#onStyle</styleUrl>"
+    "<description>{desc}</description>"
+    "<Point><coordinates>{lon:.6f},{lat:.6f},0</coordinates></Point></Placemark>"
+)
+DESC_COLUMNS = [
+    "Substation", "Region", "Tension (kV)", "Available Capacity MW Transport",
+    "Available Capacity MW Distribution", "Grid Type", "Grid Owner",
+]
+
+
 def build_kmz(df: pd.DataFrame, kmz_path: Path, icon_on: Path, icon_off: Path):
     """Cria KMZ agrupado por Region. Availability = ON para todos."""
-    kml = [
-        '<?xml version="1.0" encoding="UTF-8"?>',
-        '<kml xmlns="http://www.opengis.net/kml/2.2">',
-        "<Document>",
-        "<name>Storage</name>",
-        '<Style id="onStyle"><IconStyle><scale>1.0</scale><Icon><href>ON.png</href></Icon></IconStyle></Style>',
-        '<Style id="offStyle"><IconStyle><scale>1.0</scale><Icon><href>of.png</href></Icon></IconStyle></Style>',
-    ]
-
-   
-    for region, g in df.groupby("Region"):
-        kml.append(f"<Folder><name>{html.escape(str(region))}</name>")
-        for _, row in g.iterrows():
-            lat, lon = float(row["Latitude"]), float(row["Longitude"])
-            name = str(row.get("Substation",""))
-            desc_rows = [
-                ("Substation", _safe(row["Substation"])),
-                ("Region", _safe(row["Region"])),
-                ("Tension (kV)", _safe(row["Tension (kV)"])),
-                ("Available Capacity MW Transport", _safe(row["Available Capacity MW Transport"])),
-                ("Available Capacity MW Distribution", _safe(row["Available Capacity MW Distribution"])),
-                ("Grid Type", _safe(row["Grid Type"])),
-                ("Grid Owner", _safe(row["Grid Owner"])),
-                ("Lat, Lon", f"{lat:.6f}, {lon:.6f}"),
-            ]
-            table = "<table border='1' cellpadding='3' cellspacing='0'>" + "".join(
-                f"<tr><th align='left'>{k}</th><td>{v}</td></tr>" for k,v in desc_rows
-            ) + "</table>"
-            desc = f"<![CDATA[{table}]]>"
-            kml.append(
-                f"<Placemark><name>{html.escape(name)}</name><styleUrl>#onStyle</styleUrl>"
-                f"<description>{desc}</description>"
-                f"<Point><coordinates>{lon:.6f},{lat:.6f},0</coordinates></Point></Placemark>"
-            )
-        kml.append("</Folder>")
-
-    kml.append("</Document></kml>")
-
-    with zipfile.ZipFile(kmz_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-        zf.writestr("doc.kml", "\n".join(kml))
+    with kmlstream.KmzStream(kmz_path) as kz:
+        for line in [
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '<kml xmlns="http://www.opengis.net/kml/2.2">',
+            "<Document>",
+            "<name>Storage</name>",
+            '<Style id="onStyle"><IconStyle><scale>1.0</scale><Icon><href>ON.png</href></Icon></IconStyle></Style>',
+            '<Style id="offStyle"><IconStyle><scale>1.0</scale><Icon><href>of.png</href></Icon></IconStyle></Style>',
+        ]:
+            kz.write(line)
+
+       
+        for region, g in df.groupby("Region"):
+            kz.write(f"<Folder><name>{html.escape(str(region))}</name>")
+            for c in kmlstream.iter_chunks(g):
+                lat = c["Latitude"].astype(float)
+                lon = c["Longitude"].astype(float)
+                rows = [kmlstream.tr(col, kmlstream.safe_col(c[col])) for col in DESC_COLUMNS]
+                rows.append(kmlstream.tr("Lat, Lon", kmlstream.latlon_col(lat, lon)))
+                kmlstream.write_placemarks(
+                    kz, PLACEMARK,
+                    name=c["Substation"].map(str).map(html.escape),
+                    desc=kmlstream.cdata(kmlstream.table(rows)),
+                    lon=lon, lat=lat,
+                )
+            kz.write("</Folder>")
+
+        kz.write("</Document></kml>")
         if icon_on.exists():
-            zf.write(icon_on, "ON.png")
+            kz.add_file(icon_on, "ON.png")
         if icon_off.exists():
-            zf.write(icon_off, "of.png")
+            kz.add_file(icon_off, "of.png")
 
 
 def build_gpkg(df: pd.DataFrame, gpkg_path: Path):
@@ -143,13 +156,14 @@ def main():
     ap.add_argument("--output_gpkg", default="storage.gpkg", help="Ficheiro GeoPackage de saída (default: storage.gpkg)")
     ap.add_argument("--on_icon", default="ON.png", help="Ícone ON (default: ON.png)")
     ap.add_argument("--off_icon", default="of.png", help="Ícone OFF (default: of.png)")
+    ap.add_argument("--no-cache", action="store_true", help="Ignora a cache e relê o Excel")
     args = ap.parse_args()
 
     input_xlsx = Path(args.input)
     if not input_xlsx.exists():
         raise SystemExit(f"❌ Excel não encontrado: {input_xlsx}")
 
-    df = load_storage(input_xlsx)
+    df = load_storage(input_xlsx, use_cache=not args.no_cache)
     build_kmz(df, Path(args.output_kmz), Path(args.on_icon), Path(args.off_icon))
     print(f"✅ KMZ criado: {Path(args.output_kmz).resolve()}")
 
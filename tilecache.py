@@ -0,0 +1,86 @@
+import hashlib
+import json
+import math
+import os
+import threading
+from pathlib import Path
+
+
+CACHE_DIR = Path(os.environ.get("EDT_TILE_CACHE_DIR", ".edt_tiles"))
+CACHE_MAX_BYTES = 4 * 1024 * 1024 * 1024  # ~4 GB; os tiles menos usados saem primeiro
+OFFLINE = os.environ.get("EDT_OFFLINE", "").strip().lower() in ("1", "true", "yes")
+
+
+class TileMissing(RuntimeError):
+    """Modo offline e o tile não está em cache."""
+
+
+def tiles(bbox, size: float):
+    """Tiles de uma grelha fixa (graus) que cobrem bbox → [(tile_id, (w, s, e, n))]."""
+    w, s, e, n = bbox
+    out = []
+    for iy in range(math.floor(s / size), math.ceil(n / size)):
+        for ix in range(math.floor(w / size), math.ceil(e / size)):
+            out.append((f"{iy}_{ix}", (ix * size, iy * size, (ix + 1) * size, (iy + 1) * size)))
+    return out
+
+
+def key(**ident) -> str:
+    """Hash curto de uma identidade (serviço, camada, ...) → nome da pasta em cache."""
+    payload = json.dumps(ident, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def path(kind: str, group: str, tile_id: str, suffix: str) -> Path:
+    return CACHE_DIR / kind / group / f"{tile_id}{suffix}"
+
+
+def fetch(p: Path, download, offline: bool = None) -> bool:
+    """
+    Garante o tile em `p`: um hit atualiza o mtime (LRU); senão chama
+    download(tmp_path) e publica-o com os.replace. Devolve True se veio da cache.
+    """
+    offline = OFFLINE if offline is None else offline
+    if p.exists():
+        try:
+            os.utime(p)
+        except OSError:
+            pass
+        return True
+    if offline:
+        raise TileMissing(f"offline and tile not cached: {p}")
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_name(f"{p.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        download(tmp)
+        os.replace(tmp, p)
+    finally:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+    return False
+
+
+def evict(max_bytes: int = CACHE_MAX_BYTES):
+    """Remove os tiles menos usados (mtime mais antigo) até caber em max_bytes."""
+    if not CACHE_DIR.exists():
+        return
+    entries = []
+    for p in CACHE_DIR.rglob("*"):
+        if not p.is_file() or p.suffix == ".tmp":
+            continue
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, p))
+    total = sum(size for _, size, _ in entries)
+    for _, size, p in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            p.unlink()
+            total -= size
+        except OSError:
+            pass  # outra thread/processo já o removeu
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+
+CACHE_DIR = Path(os.environ.get("EDT_CACHE_DIR", ".edt_cache"))
+CACHE_MAX_BYTES = 512 * 1024 * 1024  # ~512 MB; as entradas menos usadas saem primeiro
+
+
+def file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def code_version(module_file: str) -> str:
+    """Hash curto do código-fonte do script que gera o dataframe (muda o código → cache inválida)."""
+    return hashlib.sha256(Path(module_file).read_bytes()).hexdigest()[:16]
+
+
+def cache_key(path: Path, version: str, **params) -> str:
+    payload = json.dumps({"file": file_sha256(path), "version": version, "params": params},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _entries(key: str):
+    return [CACHE_DIR / f"{key}.parquet", CACHE_DIR / f"{key}.pkl"]
+
+
+def load(key: str) -> Optional[pd.DataFrame]:
+    """Devolve o dataframe em cache (ou None). Um hit atualiza o mtime (LRU)."""
+    for p in _entries(key):
+        if not p.exists():
+            continue
+        try:
+            df = pd.read_parquet(p) if p.suffix == ".parquet" else pd.read_pickle(p)
+        except Exception:
+            continue
+        try:
+            os.utime(p)
+        except OSError:
+            pass
+        return df
+    return None
+
+
+def store(key: str, df: pd.DataFrame):
+    """
+    Grava em Parquet; colunas object com tipos mistos (ex.: '220' e 220 na mesma
+    coluna) não passam no pyarrow — nesse caso cai para pickle.
+    """
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    parquet, pkl = _entries(key)
+    tmp = parquet.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, parquet)
+    except Exception:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        try:
+            df.to_pickle(tmp)
+            os.replace(tmp, pkl)
+        except Exception as e:
+            print(f"⚠️ Cache não gravada ({e})")
+            return
+    evict()
+
+
+def evict(max_bytes: int = CACHE_MAX_BYTES):
+    """Remove as entradas menos usadas (mtime mais antigo) até caber em max_bytes."""
+    if not CACHE_DIR.exists():
+        return
+    entries = []
+    for p in CACHE_DIR.iterdir():
+        if p.suffix not in (".parquet", ".pkl"):
+            continue
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, p))
+    total = sum(size for _, size, _ in entries)
+    for _, size, p in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            p.unlink()
+            total -= size
+        except OSError:
+            pass  # outro processo já a removeu